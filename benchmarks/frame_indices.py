@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of `utils.get_frame_indices` over the frame counts and fps of the VidHal videos, against the previous loop-based planner.
+Deterministic sampling modes are checked to plan the same frames as the previous planner.
+
+    python -m benchmarks.frame_indices --videos_path vidhal/videos [--metadata_index_path vidhal/video_metadata.json]
+"""
+import os
+import time
+import random
+import argparse
+import numpy as np
+
+from frames import load_metadata_index
+from utils import get_frame_indices
+
+def get_frame_indices_loop(num_frames, vlen, sample='rand', fix_start=None, fps=1, max_num_frames=-1, clip=None):
+    """
+    Previous planner, kept as the reference of the benchmark
+    """
+    if sample in ["rand", "middle"]:
+        acc_samples = min(num_frames, vlen)
+        intervals = np.linspace(start=0, stop=vlen, num=acc_samples + 1).astype(int)
+        ranges = []
+        for idx, interv in enumerate(intervals[:-1]):
+            ranges.append((interv, intervals[idx + 1] - 1))
+        if sample == 'rand':
+            try:
+                frame_indices = [random.choice(range(x[0], x[1])) for x in ranges]
+            except:
+                frame_indices = np.random.permutation(vlen)[:acc_samples]
+                frame_indices.sort()
+                frame_indices = list(frame_indices)
+        elif fix_start is not None:
+            frame_indices = [x[0] + fix_start for x in ranges]
+        elif sample == 'middle':
+            if clip:
+                start_idx, end_idx = round(clip[0] * fps), min(round(clip[1] * fps), max_num_frames)
+            else:
+                if max_num_frames < 0:
+                    max_num_frames = vlen - 1
+                start_idx, end_idx  = 0, max_num_frames
+            seg_size = float(end_idx - start_idx) / num_frames
+            frame_indices = np.array([
+                int(start_idx + (seg_size / 2) + np.round(seg_size * idx)) for idx in range(num_frames)
+            ])
+        else:
+            raise NotImplementedError
+
+        if len(frame_indices) < num_frames:
+            padded_frame_indices = [frame_indices[-1]] * num_frames
+            padded_frame_indices[:len(frame_indices)] = frame_indices
+            frame_indices = padded_frame_indices
+    elif "fps" in sample:
+        output_fps = float(sample[3:])
+        duration = float(vlen) / fps
+        delta = 1 / output_fps
+        frame_seconds = np.arange(0 + delta / 2, duration + delta / 2, delta)
+        frame_indices = np.around(frame_seconds * fps).astype(int)
+        frame_indices = [e for e in frame_indices if e < vlen]
+        if max_num_frames > 0 and len(frame_indices) > max_num_frames:
+            frame_indices = frame_indices[:max_num_frames]
+    elif sample == "uniform": # MovieChat
+        frame_indices = np.arange(0, vlen, vlen / min(num_frames, vlen)).astype(int).tolist()
+    elif sample == "linspace": # API models
+        frame_indices = np.linspace(0, vlen - 1, num=min(num_frames, vlen), dtype=int).tolist()
+    else:
+        raise ValueError
+    return frame_indices
+
+# Sampling configurations of the video loaders: (name, kwargs as a function of the frame count and fps of the video)
+CONFIGS = [
+    ("middle-8", lambda vlen, fps : dict(num_frames=8, sample="middle", max_num_frames=vlen - 1)),
+    ("middle-32", lambda vlen, fps : dict(num_frames=32, sample="middle", max_num_frames=vlen - 1)),
+    ("middle-all", lambda vlen, fps : dict(num_frames=vlen, sample="middle", max_num_frames=vlen - 1)),
+    ("fix_start-16", lambda vlen, fps : dict(num_frames=16, sample="middle", fix_start=0)),
+    ("clip-16", lambda vlen, fps : dict(num_frames=16, sample="middle", fps=fps, max_num_frames=vlen - 1, clip=(0.5, vlen / fps / 2))),
+    ("fps1", lambda vlen, fps : dict(num_frames=None, sample="fps1", fps=fps, max_num_frames=vlen - 1)),
+    ("fps0.5", lambda vlen, fps : dict(num_frames=None, sample="fps0.5", fps=fps, max_num_frames=vlen - 1)),
+    ("uniform-8", lambda vlen, fps : dict(num_frames=8, sample="uniform")),
+    ("linspace-8", lambda vlen, fps : dict(num_frames=8, sample="linspace")),
+    ("rand-16", lambda vlen, fps : dict(num_frames=16, sample="rand")),
+]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Frame index planner benchmark")
+    parser.add_argument("--videos_path", type=str, default="vidhal/videos")
+    parser.add_argument("--metadata_index_path", type=str, default=None) # Defaults to video_metadata.json beside the videos
+    parser.add_argument("--repeats", type=int, default=20)
+
+    return parser.parse_args()
+
+def time_planner(planner, videos, config, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        plans = [planner(vlen=vlen, **config(vlen, fps)) for vlen, fps in videos]
+
+    return (time.perf_counter() - start) / repeats, plans
+
+def main():
+    args = parse_arguments()
+    video_paths = sorted(os.path.join(args.videos_path, x) for x in os.listdir(args.videos_path) if x.endswith(".mp4"))
+    index_path = args.metadata_index_path or os.path.join(os.path.dirname(os.path.normpath(args.videos_path)), "video_metadata.json")
+    metadata_index = load_metadata_index(index_path, video_paths=video_paths)
+    videos = [(entry["num_frames"], entry["fps"]) for entry in (metadata_index.get(x, save=False) for x in video_paths)]
+    print(f"{len(videos)} videos, {np.mean([x[0] for x in videos]):.0f} frames on average")
+
+    print(f"{'config':>14} {'loop (ms)':>10} {'vectorized (ms)':>16} {'speedup':>8} {'same plans':>11}")
+    for name, config in CONFIGS:
+        loop_time, loop_plans = time_planner(get_frame_indices_loop, videos, config, args.repeats)
+        vectorized_time, plans = time_planner(get_frame_indices, videos, config, args.repeats)
+        same = "-" if name.startswith("rand") else str(all(np.array_equal(np.asarray(x), y) for x, y in zip(loop_plans, plans)))
+        print(f"{name:>14} {1000 * loop_time:10.2f} {1000 * vectorized_time:16.2f} {loop_time / vectorized_time:7.1f}x {same:>11}")
+
+if __name__ == "__main__":
+    main()
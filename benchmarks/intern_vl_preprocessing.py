@@ -0,0 +1,57 @@
+"""
+CPU benchmark of the batched tensor preprocessing of InternVL2.5 against the previous per-frame PIL preprocessing, reporting the
+difference between their outputs.
+
+    python -m benchmarks.intern_vl_preprocessing [--video_path vidhal/videos/<video_id>.mp4] --num_frames 16 --max_num 1
+"""
+import time
+import argparse
+import torch
+
+from utils import read_video
+from models.InternVL.processors.visual_processor import InternVL25VisualProcessor
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="InternVL2.5 preprocessing benchmark")
+    parser.add_argument("--video_path", type=str, default=None) # Frames are read from the video if provided, otherwise random
+    parser.add_argument("--num_frames", type=int, default=16)
+    parser.add_argument("--height", type=int, default=720) # Resolution of random frames
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--max_num", type=int, default=1) # Maximum number of tiles per frame
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=5)
+
+    return parser.parse_args()
+
+def time_fn(fn, x, repeats):
+    fn(x) # Warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = fn(x)
+
+    return (time.perf_counter() - start) / repeats, outputs
+
+@torch.no_grad()
+def main():
+    args = parse_arguments()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    if args.video_path is not None:
+        frames, _, _ = read_video(args.video_path, num_frames=args.num_frames, sample="middle")
+    else:
+        frames = torch.randint(0, 256, (args.num_frames, 3, args.height, args.width), dtype=torch.uint8)
+    vis_processor = InternVL25VisualProcessor(max_num=args.max_num)
+
+    pil_time, (pil_pixel_values, pil_num_patches) = time_fn(vis_processor.forward_pil, frames, args.repeats)
+    tensor_time, (pixel_values, num_patches) = time_fn(vis_processor, frames, args.repeats)
+    assert num_patches == pil_num_patches and pixel_values.shape == pil_pixel_values.shape
+
+    difference = (pixel_values - pil_pixel_values).abs()
+    print(f"{tuple(frames.shape)} -> {tuple(pixel_values.shape)}")
+    print(f"   PIL: {1000 * pil_time:8.1f} ms")
+    print(f"tensor: {1000 * tensor_time:8.1f} ms ({pil_time / tensor_time:.1f}x)")
+    print(f"difference: max {difference.max().item():.4f}, mean {difference.mean().item():.5f} (one uint8 level is {1 / (255 * max(vis_processor.IMAGENET_STD)):.4f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the DINO-based frame pruning of LongVU on VidHal videos, reporting the number of frames kept by `select_frame` and
+the time spent in each vision tower. The DINO tower encodes all sampled frames and the SigLIP tower only the kept frames, which is
+compared against encoding all sampled frames with SigLIP:
+
+    python -m benchmarks.longvu_frame_pruning --videos_path vidhal/videos --num_videos 16 --num_frames 1000
+"""
+import os
+import time
+import argparse
+import torch
+
+from utils import read_video
+from models.LongVU import load_model
+from models.LongVU.longvu.mm_datautils import tokenizer_image_token
+from models.LongVU.longvu.constants import IMAGE_TOKEN_INDEX
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="LongVU frame pruning benchmark")
+    parser.add_argument("--model_path", type=str, default=None)
+    parser.add_argument("--videos_path", type=str, default="vidhal/videos")
+    parser.add_argument("--num_videos", type=int, default=16)
+    parser.add_argument("--num_frames", type=int, default=1000) # Frames sampled per video, capped by the length of the video
+    parser.add_argument("--prompt", type=str, default="Describe the video.") # Prompt whose length bounds the number of frames kept
+
+    return parser.parse_args()
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+def time_fn(fn, device):
+    synchronize(device)
+    start = time.perf_counter()
+    outputs = fn()
+    synchronize(device)
+
+    return time.perf_counter() - start, outputs
+
+@torch.no_grad()
+def main():
+    args = parse_arguments()
+    model, vis_processor, text_processor = load_model(args.model_path)
+    device = model.device
+    input_ids = tokenizer_image_token(
+        text_processor(args.prompt).get_prompt(), text_processor.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt"
+    ).unsqueeze(0).to(device)
+    threshold = getattr(model.get_model().config, "dino_threshold", 0.83)
+
+    video_paths = sorted(os.path.join(args.videos_path, x) for x in os.listdir(args.videos_path) if x.endswith(".mp4"))[:args.num_videos]
+    totals = dict(frames=0, kept=0, dino=0., siglip_kept=0., siglip_all=0.)
+    print(f"{'video':>24} {'frames':>7} {'kept':>6} {'dino (ms)':>10} {'siglip kept (ms)':>17} {'siglip all (ms)':>16}")
+    for video_path in video_paths:
+        frames, _, _ = read_video(video_path=video_path, num_frames=args.num_frames, sample="middle")
+        video, image_sizes = vis_processor(frames)
+        images = [x.squeeze(0).to(device) for x in video]
+
+        dino_time, dino_features = time_fn(lambda: model.encode_images(images, encode_type="dino"), device)
+        _, _, kept_images, _ = model.select_frame(dino_features, [len(frames)], input_ids, images, image_sizes, threshold=threshold)
+        siglip_kept_time, _ = time_fn(lambda: model.encode_images(kept_images, encode_type="siglip"), device)
+        siglip_all_time, _ = time_fn(lambda: model.encode_images(images, encode_type="siglip"), device)
+
+        num_kept = len(kept_images[0])
+        for key, value in zip(totals, [len(frames), num_kept, dino_time, siglip_kept_time, siglip_all_time]):
+            totals[key] += value
+        print(f"{os.path.basename(video_path)[:24]:>24} {len(frames):7d} {num_kept:6d} {1000 * dino_time:10.1f} {1000 * siglip_kept_time:17.1f} {1000 * siglip_all_time:16.1f}")
+
+    pruned_time = totals["dino"] + totals["siglip_kept"]
+    unpruned_time = totals["dino"] + totals["siglip_all"]
+    print(f"{totals['kept']} / {totals['frames']} frames kept ({100 * totals['kept'] / max(1, totals['frames']):.1f}%)")
+    print(f"vision towers: {1000 * pruned_time:.1f} ms with pruning before SigLIP, {1000 * unpruned_time:.1f} ms without ({unpruned_time / pruned_time:.2f}x)")
+
+if __name__ == "__main__":
+    main()
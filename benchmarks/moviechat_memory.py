@@ -0,0 +1,86 @@
+"""
+Benchmark of the MovieChat video memory path (fragments -> short-term memory -> long-term memory -> video Q-Former), using the
+small randomly initialised MovieChat of `models/MovieChat/configs/tiny_random.yaml` by default, such that it runs on CPU without any weights:
+
+    python -m benchmarks.moviechat_memory --device cpu --num_fragments 128 [--video_path vidhal/videos/<video_id>.mp4]
+"""
+import time
+import argparse
+import torch
+from omegaconf import OmegaConf
+
+from frames import get_video_metadata
+from models.MovieChat import MovieChat, Chat, AlproVideoEvalProcessor
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="MovieChat video memory benchmark")
+    parser.add_argument("--config_path", type=str, default="models/MovieChat/configs/tiny_random.yaml")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--num_fragments", type=int, default=128) # Number of fragments of the video, as sampled by `Chat`
+    parser.add_argument("--video_path", type=str, default=None) # Fragments are sampled from the video if provided, otherwise random
+    parser.add_argument("--middle_video", action="store_true") # Breakpoint mode of `encode_long_video`
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+
+    return parser.parse_args()
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+@torch.no_grad()
+def main():
+    args = parse_arguments()
+    torch.manual_seed(args.seed)
+
+    config = OmegaConf.load(args.config_path)
+    model = MovieChat.from_config(config.model).to(args.device).eval()
+    vis_processor_cfg = config.datasets.webvid.vis_processor.train
+    chat = Chat(
+        model=model, vis_processor=AlproVideoEvalProcessor(image_size=vis_processor_cfg.image_size, n_frms=vis_processor_cfg.n_frms),
+        device=args.device
+    )
+    image_size, n_frms = vis_processor_cfg.image_size, vis_processor_cfg.n_frms
+
+    def sample_fragments():
+        if args.video_path is None:
+            return [torch.randn(1, 3, n_frms, image_size, image_size) for _ in range(args.num_fragments)]
+        video_fragments = chat.load_video_fragments(
+            video_path=args.video_path, video_length=get_video_metadata(args.video_path)["duration"],
+            num_fragments=args.num_fragments, n_frms=n_frms, height=image_size, width=image_size
+        )
+        return [chat.vis_processor.transform(x).unsqueeze(0) for x in video_fragments]
+
+    cur_image = torch.randn(1, 3, 1, image_size, image_size)
+    stages = ["sample_fragments", "encode_image", "short_memory", "long_memory"]
+    timings = {stage : [] for stage in stages}
+    for repeat in range(args.warmup + args.repeats):
+        times = [time.perf_counter()]
+        video_fragments = sample_fragments()
+        times.append(time.perf_counter())
+        image_emb = model.encode_image(cur_image.to(args.device))
+        synchronize(args.device)
+        times.append(time.perf_counter())
+        model.encode_short_memory_frames(video_fragments, device=args.device)
+        synchronize(args.device)
+        times.append(time.perf_counter())
+        num_long_memory = len(model.long_memory_buffer)
+        video_emb, _ = model.encode_long_video(image_emb, args.middle_video)
+        synchronize(args.device)
+        times.append(time.perf_counter())
+        model.clear_memory_buffers()
+
+        if repeat >= args.warmup:
+            for stage, start, end in zip(stages, times[:-1], times[1:]):
+                timings[stage].append(end - start)
+
+    num_frames = sum(x.shape[0] * x.shape[2] for x in video_fragments)
+    print(f"{args.num_fragments} fragments, {num_frames} frames, {num_long_memory} long-term memory frames -> video embedding {tuple(video_emb.shape)} ({video_emb.dtype}, {video_emb.device})")
+    for stage in stages:
+        print(f"{stage:>16}: {1000 * sum(timings[stage]) / len(timings[stage]):10.1f} ms")
+    total = sum(sum(x) / len(x) for x in timings.values())
+    print(f"{'total':>16}: {1000 * total:10.1f} ms ({num_frames / total:.1f} frames/s)")
+
+if __name__ == "__main__":
+    main()
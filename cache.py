@@ -0,0 +1,200 @@
+import os
+import json
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from utils import read_video, get_frame_indices
+from frames import read_frames_cv2, get_video_metadata
+
+class VideoFrameCache:
+    """
+    On-disk cache of sampled video frames, stored as memory-mappable .npy arrays of shape (T, C, H, W) in uint8.
+
+    Entries are keyed by the video name, the file's modification time and size, and the frame sampling parameters
+    passed to `read_video`, so a changed video file or sampling configuration never returns stale frames.
+    Once the total size of the cache exceeds `max_size` bytes, the least recently used entries are evicted.
+    """
+    DEFAULT_MAX_SIZE = 32 * 1024 ** 3
+    def __init__(self, cache_dir, max_size=None) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size if max_size is not None else self.DEFAULT_MAX_SIZE
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, video_path, num_frames=None, sample="middle", fix_start=None, clip=None):
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        stat = os.stat(video_path)
+        key = json.dumps([
+            video_name, stat.st_mtime_ns, stat.st_size, num_frames, sample, fix_start,
+            list(clip) if clip is not None else None
+        ])
+
+        return f"{video_name}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def load(self, key):
+        frames_path = os.path.join(self.cache_dir, f"{key}.npy")
+        metadata_path = os.path.join(self.cache_dir, f"{key}.json")
+        if not (os.path.isfile(frames_path) and os.path.isfile(metadata_path)):
+            return None
+
+        try:
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+            # Copy-on-write mapping, frames are only paged in from disk when accessed
+            frames = torch.from_numpy(np.load(frames_path, mmap_mode="c"))
+        except (OSError, ValueError):
+            return None
+        try:
+            # Refresh access time for LRU eviction
+            os.utime(frames_path)
+        except OSError:
+            # Evicted by another process since loading, the mapped frames remain valid
+            pass
+
+        return frames, np.asarray(metadata["frame_indices"], dtype=np.int64), metadata["fps"]
+
+    def save(self, key, frames, frame_indices, fps):
+        frames_path = os.path.join(self.cache_dir, f"{key}.npy")
+        metadata_path = os.path.join(self.cache_dir, f"{key}.json")
+
+        # Write to temporary files first so concurrent readers never observe partial entries
+        with open(f"{frames_path}.{os.getpid()}.tmp", "wb") as f:
+            np.save(f, frames.contiguous().numpy())
+        with open(f"{metadata_path}.{os.getpid()}.tmp", "w") as f:
+            json.dump({"frame_indices" : [int(x) for x in frame_indices], "fps" : float(fps)}, f)
+        os.replace(f"{metadata_path}.{os.getpid()}.tmp", metadata_path)
+        os.replace(f"{frames_path}.{os.getpid()}.tmp", frames_path)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if not file.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.splitext(file)[0]))
+
+        total_size = sum(x[1] for x in entries)
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for extension in [".npy", ".json"]:
+                try:
+                    os.remove(os.path.join(self.cache_dir, f"{key}{extension}"))
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+
+    def read_video(self, video_path, num_frames=None, sample="middle", fix_start=None, clip=None):
+        """
+        Drop-in replacement for `utils.read_video` that decodes the video only on a cache miss.
+        """
+        # Random sampling is not reproducible, hence always decoded
+        if sample == "rand":
+            return read_video(video_path, num_frames=num_frames, sample=sample, fix_start=fix_start, clip=clip)
+
+        key = self.get_key(video_path, num_frames=num_frames, sample=sample, fix_start=fix_start, clip=clip)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+
+        frames, frame_indices, fps = read_video(video_path, num_frames=num_frames, sample=sample, fix_start=fix_start, clip=clip)
+        self.save(key, frames, frame_indices, fps)
+
+        return frames, frame_indices, fps
+
+def get_api_frame_indices(total_frames, fps, seconds_per_frame=None, max_frames=None):
+    """
+    Frame sampling policies of the API pipelines: one frame every `seconds_per_frame` seconds, or `max_frames` evenly spaced frames
+    """
+    if max_frames is not None:
+        return get_frame_indices(max_frames, total_frames, sample="linspace").tolist()
+
+    return list(range(0, total_frames - 1, max(1, int(fps * seconds_per_frame))))
+
+def encode_frames(video_path, seconds_per_frame=None, max_frames=None, quality=95, max_side=None):
+    """
+    Returns the sampled frames of the video as base64-encoded JPEG strings, downscaled such that the longer side is at most `max_side` if provided
+    """
+    base64_frames = []
+
+    metadata = get_video_metadata(video_path)
+    frame_indices = get_api_frame_indices(metadata["num_frames"], metadata["fps"], seconds_per_frame=seconds_per_frame, max_frames=max_frames)
+    frames = read_frames_cv2(video_path, frame_indices)
+    for frame_idx in frame_indices:
+        if frame_idx not in frames:
+            # Frames after a failed read are not retrieved by the 1 frame per second policy
+            if max_frames is None:
+                break
+            continue
+        frame = frames[frame_idx]
+        if max_side is not None and max(frame.shape[:2]) > max_side:
+            scale = max_side / max(frame.shape[:2])
+            frame = cv2.resize(frame, (round(frame.shape[1] * scale), round(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        base64_frames.append(base64.b64encode(buffer).decode("utf-8"))
+
+    return base64_frames
+
+class EncodedFrameStore:
+    """
+    On-disk store of the base64-encoded JPEG frames sent to API-based models, stored as JSON lists of strings.
+
+    Entries are keyed by the video name, the file's modification time and size, and the encoding parameters of `encode_frames`
+    (sampling policy, JPEG quality and maximum side), such that requests can be built without decoding or encoding any frames.
+    """
+    def __init__(self, store_dir) -> None:
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def get_key(self, video_path, **encoding):
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        stat = os.stat(video_path)
+        key = json.dumps([video_name, stat.st_mtime_ns, stat.st_size, sorted(encoding.items())])
+
+        return f"{video_name}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.store_dir, f"{key}.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, frames):
+        path = os.path.join(self.store_dir, f"{key}.json")
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(frames, f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def encode_frames(self, video_path, **encoding):
+        """
+        Drop-in replacement for `encode_frames` that only decodes and encodes the video if it is not already in the store
+        """
+        key = self.get_key(video_path, **encoding)
+        frames = self.load(key)
+        if frames is None:
+            frames = encode_frames(video_path, **encoding)
+            self.save(key, frames)
+
+        return frames
+
+    def build(self, video_paths, num_workers=8, **encoding):
+        """
+        Encodes all videos not yet in the store in parallel (OpenCV releases the GIL while decoding and encoding)
+        """
+        video_paths = [x for x in video_paths if not os.path.isfile(os.path.join(self.store_dir, f"{self.get_key(x, **encoding)}.json"))]
+        if len(video_paths) < 1:
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for _ in tqdm(executor.map(lambda x: self.encode_frames(x, **encoding), video_paths), total=len(video_paths), desc="Encoding frames"):
+                pass
@@ -3,9 +3,10 @@ import json
 
 from torch.utils.data import Dataset
 from utils import read_video
+from cache import VideoFrameCache
 
 class VidHalDataset(Dataset):
-    def __init__(self, data_path, video_root, vis_processor, num_frames, load_video=True) -> None:
+    def __init__(self, data_path, video_root, vis_processor, num_frames, load_video=True, frame_cache_dir=None, frame_cache_size=None) -> None:
         super().__init__()
 
         with open(data_path, "r") as f:
@@ -15,6 +16,8 @@ class VidHalDataset(Dataset):
         self.num_frames = num_frames
         self.vis_processor = vis_processor
         self.load_video = load_video
+        # Optional on-disk cache of decoded frames, shared across runs
+        self.frame_cache = VideoFrameCache(frame_cache_dir, max_size=frame_cache_size) if frame_cache_dir is not None else None
     
     def __len__(self):
         return len(self.examples)
@@ -24,7 +27,9 @@ class VidHalDataset(Dataset):
         video_name, captions, aspect = example["video"], example["captions"], example["aspect"]
         video_path = os.path.join(self.video_root, f"{video_name}.mp4")
 
-        if self.load_video:
+        if self.load_video and self.frame_cache is not None:
+            video, _, _ = self.frame_cache.read_video(video_path=video_path, num_frames=self.num_frames, sample="middle")
+        elif self.load_video:
             video, _, _ = read_video(video_path=video_path, num_frames=self.num_frames, sample="middle")
         else:
             video = None
@@ -36,4 +41,38 @@ class VidHalDataset(Dataset):
             "video" : video, "video_id" : video_name, "video_path" : video_path,
             "captions" : captions, "aspect" : aspect
         }
-    
\ No newline at end of file
+    
+class VidHalAnnotationIndex:
+    """
+    Annotation-only view of VidHal, stored column-wise in memory. Used in place of VidHalDataset where only the
+    annotations are required (e.g. evaluation), so that no video files are read or even required to be present.
+    """
+    def __init__(self, examples) -> None:
+        self.video_ids = [example["video"] for example in examples]
+        self.captions = [example["captions"] for example in examples]
+        self.aspects = [example["aspect"] for example in examples]
+        self.index = {video_id : i for i, video_id in enumerate(self.video_ids)}
+
+    @classmethod
+    def from_file(cls, data_path):
+        with open(data_path, "r") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return dataset if isinstance(dataset, cls) else cls(dataset.examples)
+
+    def option_orders(self, option_display_order):
+        """
+        Returns the option display order (option -> rank) of each example, aligned with the rows of the index
+        """
+        return [option_display_order[video_id] for video_id in self.video_ids]
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def __getitem__(self, index):
+        return {
+            "video" : None, "video_id" : self.video_ids[index], "video_path" : None,
+            "captions" : self.captions[index], "aspect" : self.aspects[index]
+        }
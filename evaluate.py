@@ -2,16 +2,14 @@ import os
 import json
 
 from utils import parse_arguments
-from dataset import VidHalDataset
+from dataset import VidHalAnnotationIndex
 from pipelines.evaluation import VidHalMCQAEvaluationPipeline, VidHalCaptionOrderingEvaluationPipeline
 
 if __name__ == "__main__":
     args = parse_arguments()
 
-    # Load dataset
-    dataset = VidHalDataset(
-        args.annotations_path, args.videos_path, vis_processor=None, num_frames=args.num_frames, load_video=(args.model != "random")
-    )
+    # Load annotations only, videos are not required for evaluation
+    dataset = VidHalAnnotationIndex.from_file(args.annotations_path)
     if args.options_path:
         with open(args.options_path, "r") as f:
             option_display_order = json.load(f)
@@ -0,0 +1,165 @@
+"""
+Frame extraction with OpenCV (grab/read), planning for each sampled frame whether to seek to the preceding keyframe or
+to keep decoding forward from the current position, instead of seeking (and re-decoding from a keyframe) for every frame.
+Loaders reading frames with decord keep `VideoReader.get_batch`, which is faster than decoding planned frames one at a time.
+Also holds the index of video metadata (e.g. frame count, fps and keyframes) shared by the video loaders.
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from decord import VideoReader
+
+SEEK_COST = 16 # Cost of a seek, in number of decoded frames (demuxer seek and decoder flush)
+
+class VideoMetadataIndex:
+    """
+    Index of video metadata (frame count, average fps, duration, resolution and keyframe indices), computed once per video
+    and persisted to `index_path` if provided. Entries are keyed by video name, and recomputed if the video file changes.
+    """
+    def __init__(self, index_path=None) -> None:
+        self.index_path = index_path
+        self.entries = {}
+        if index_path is not None and os.path.isfile(index_path):
+            with open(index_path, "r") as f:
+                self.entries = json.load(f)
+        self.lock = threading.Lock()
+
+    def compute(self, video_path):
+        stat = os.stat(video_path)
+        video_reader = VideoReader(video_path, num_threads=1)
+        num_frames, fps = len(video_reader), float(video_reader.get_avg_fps())
+        height, width, _ = video_reader[0].shape
+
+        return {
+            "mtime_ns" : stat.st_mtime_ns, "size" : stat.st_size,
+            "num_frames" : num_frames, "fps" : fps, "duration" : num_frames / fps,
+            "height" : int(height), "width" : int(width),
+            "keyframes" : [int(x) for x in video_reader.get_key_indices()]
+        }
+
+    def is_valid(self, entry, video_path):
+        if entry is None:
+            return False
+        stat = os.stat(video_path)
+        return entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+    def get(self, video_path, save=True):
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        entry = self.entries.get(video_name)
+        if not self.is_valid(entry, video_path):
+            entry = self.compute(video_path)
+            with self.lock:
+                self.entries[video_name] = entry
+                if save:
+                    self.save()
+
+        return entry
+
+    def save(self):
+        if self.index_path is None:
+            return
+        with open(f"{self.index_path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(f"{self.index_path}.{os.getpid()}.tmp", self.index_path)
+
+    def build(self, video_paths, num_workers=8):
+        """
+        Indexes all videos not yet indexed in parallel
+        """
+        video_paths = [x for x in video_paths if not self.is_valid(self.entries.get(os.path.splitext(os.path.basename(x))[0]), x)]
+        if len(video_paths) < 1:
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(lambda x: self.get(x, save=False), video_paths))
+        with self.lock:
+            self.save()
+
+METADATA_INDEX = VideoMetadataIndex() # In-memory only, unless replaced with `load_metadata_index`
+def load_metadata_index(index_path, video_paths=None, num_workers=8):
+    """
+    Sets the metadata index shared by the video loaders to the one persisted at `index_path`, indexing `video_paths` if provided
+    """
+    global METADATA_INDEX
+    METADATA_INDEX = VideoMetadataIndex(index_path)
+    if video_paths is not None:
+        METADATA_INDEX.build(video_paths, num_workers=num_workers)
+
+    return METADATA_INDEX
+
+def get_video_metadata(video_path):
+    return METADATA_INDEX.get(video_path)
+
+def get_keyframe_indices(video_path):
+    """
+    Returns the indices of the keyframes in the video, or None if they cannot be read
+    """
+    try:
+        return get_video_metadata(video_path)["keyframes"]
+    except Exception:
+        return None
+
+def plan_frame_reads(frame_indices, keyframe_indices=None, seek_cost=SEEK_COST):
+    """
+    Plans the decoding of the (sorted) frames in `frame_indices`, given the keyframes of the video.
+
+    Reaching frame t from the current position p (the frame following the last decoded frame) costs either t - p decoded frames
+    by scanning forward, or seek_cost + t - k by seeking to the last keyframe k <= t. Seeks are hence only used when they skip
+    enough frames, so that dense sampling is read in a single forward pass, and sparse sampling seeks from keyframe to keyframe.
+    If the keyframes are unknown, every frame is seeked to, as decoders seek to the preceding keyframe regardless.
+
+    Returns:
+        plan (list) : Of (seek_index, frame_index) in order of decoding, where seek_index is the frame to seek to before decoding
+            up to frame_index, or None to continue decoding from the current position
+    """
+    if keyframe_indices is not None and len(keyframe_indices) < 1:
+        keyframe_indices = None
+
+    plan, position = [], None
+    for frame_index in sorted(set(int(x) for x in frame_indices)):
+        if keyframe_indices is None:
+            plan.append((frame_index, frame_index))
+            position = frame_index + 1
+            continue
+
+        keyframe_index = keyframe_indices[max(np.searchsorted(keyframe_indices, frame_index, side="right") - 1, 0)]
+        if position is None or frame_index < position or keyframe_index - position > seek_cost:
+            plan.append((keyframe_index, frame_index))
+        else:
+            plan.append((None, frame_index))
+        position = frame_index + 1
+
+    return plan
+
+def read_frames_cv2(video_path, frame_indices, keyframe_indices=None):
+    """
+    Reads the frames at `frame_indices` with OpenCV following `plan_frame_reads`, skipping frames that cannot be read.
+
+    Returns:
+        frames (dict) : Frame index -> BGR frame, for the frames read successfully
+    """
+    if keyframe_indices is None:
+        keyframe_indices = get_keyframe_indices(video_path)
+
+    frames = {}
+    video = cv2.VideoCapture(video_path)
+    position = 0
+    for seek_index, frame_index in plan_frame_reads(frame_indices, keyframe_indices):
+        if seek_index is not None:
+            video.set(cv2.CAP_PROP_POS_FRAMES, seek_index)
+            position = seek_index
+        # Decode intermediate frames without converting them
+        success = True
+        while success and position < frame_index:
+            success = video.grab()
+            position += 1
+        success, frame = video.read() if success else (False, None)
+        position += 1
+        if success:
+            frames[frame_index] = frame
+    video.release()
+
+    return frames
@@ -4,11 +4,14 @@ import json
 from utils import parse_arguments
 from models import load_model
 from dataset import VidHalDataset
-from pipelines.inference import get_inference_pipeline
+from frames import load_metadata_index
+from pipelines.inference import get_inference_pipeline, run_tasks
+from pipelines.inference.gemini import GeminiFileRegistry
 
 if __name__ == "__main__":
     args = parse_arguments()
 
+    assert args.videos_path is not None, "Path to videos must be provided when running inference!"
     # Load model and dataset
     model, vis_processor, text_processor = load_model(
         args.model,
@@ -20,8 +23,15 @@ if __name__ == "__main__":
         mm_pooling_position=args.mm_pooling_position,
     )
     dataset = VidHalDataset(
-        args.annotations_path, args.videos_path, vis_processor, args.num_frames, load_video=(args.model != "random")
+        args.annotations_path, args.videos_path, vis_processor, args.num_frames, load_video=(args.model != "random"),
+        frame_cache_dir=args.frame_cache_dir, frame_cache_size=int(args.frame_cache_size * 1024 ** 3)
     )
+    if args.model != "random":
+        # Index metadata of all videos once, shared by the video loaders
+        load_metadata_index(
+            args.metadata_index_path or os.path.join(os.path.dirname(args.annotations_path), "video_metadata.json"),
+            video_paths=[os.path.join(args.videos_path, f"{example['video']}.mp4") for example in dataset.examples]
+        )
     if args.options_path:
         with open(args.options_path, "r") as f:
             option_display_order = json.load(f)
@@ -33,17 +43,34 @@ if __name__ == "__main__":
         with open(api_key, "r") as f:
             api_key = f.readlines()[0].strip()
     # Load inference pipeline and run inference
-    inference_pipeline = get_inference_pipeline(args.model, args.task)(
+    tasks = args.task.split(",")
+    assert len(tasks) == 1 or "{task}" in args.save_path, "Save path must contain {task} when running multiple tasks!"
+    # Videos uploaded to Gemini are registered once, and shared by the pipelines of all tasks
+    upload_registry = GeminiFileRegistry(args.upload_registry_path) if args.model.startswith("gemini") else None
+    inference_pipelines = {task : get_inference_pipeline(args.model, task)(
         model=model, dataset=dataset,
         vis_processor=vis_processor, text_processor=text_processor,
         model_path=args.model_path,
         num_captions=args.num_captions, 
         option_display_order=option_display_order,
+        num_workers=args.num_workers, prefetch_factor=args.prefetch_factor, pin_memory=args.pin_memory,
+        batch_size=args.batch_size, cache_visual_features=not args.disable_visual_feature_cache,
+        use_prefix_cache=args.prefix_cache, scoring=args.scoring, fsync_interval=args.fsync_interval,
         # For proprietary nmodels
-        api_key=api_key,
+        api_key=api_key, api_base_url=args.api_base_url,
+        max_concurrency=args.max_concurrency, requests_per_minute=args.requests_per_minute, max_retries=args.max_retries,
+        frame_store_dir=args.frame_store_dir, frame_store_workers=args.frame_store_workers,
+        jpeg_quality=args.jpeg_quality, max_frame_side=args.max_frame_side,
+        upload_registry=upload_registry,
         # For MovieChat
-        fragment_video_path=args.fragment_video_path
+        fragment_video_path=args.fragment_video_path, memory_cache_size=args.memory_cache_size
         # TODO: Additional arguments if any are added
-    )
-    os.makedirs(os.path.dirname(args.save_path), exist_ok=True)
-    inference_pipeline.run(save_path=args.save_path)
+    ) for task in tasks}
+    save_paths = {task : args.save_path.format(task=task) for task in tasks}
+    for save_path in save_paths.values():
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+    if len(tasks) == 1:
+        inference_pipelines[tasks[0]].run(save_path=save_paths[tasks[0]])
+    else:
+        run_tasks(inference_pipelines, save_paths=save_paths)
@@ -1,14 +1,25 @@
 import torch
 from PIL import Image
 from torch import nn
+import torch.nn.functional as F
 import torchvision.transforms as T
 from torchvision.transforms.functional import InterpolationMode
 
 class InternVL25VisualProcessor(nn.Module):
     IMAGENET_MEAN = (0.485, 0.456, 0.406)
     IMAGENET_STD = (0.229, 0.224, 0.225)
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, image_size=448, min_num=1, max_num=1, use_thumbnail=True, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
+        self.image_size = image_size
+        self.min_num = min_num
+        self.max_num = max_num # Maximum number of tiles per frame
+        self.use_thumbnail = use_thumbnail
+        self.aspect_ratios = {} # Resolution of the frames -> (columns, rows) of tiles, selected once per resolution
+
+        # Normalization fused into a single multiply-subtract of the uint8 pixel values
+        mean, std = torch.tensor(self.IMAGENET_MEAN), torch.tensor(self.IMAGENET_STD)
+        self.register_buffer("scale", (1 / (255 * std)).view(1, 3, 1, 1), persistent=False)
+        self.register_buffer("shift", (mean / std).view(1, 3, 1, 1), persistent=False)
 
     def build_transform(self, input_size: int = 448):
         MEAN, STD = self.IMAGENET_MEAN, self.IMAGENET_STD
@@ -35,19 +46,26 @@ class InternVL25VisualProcessor(nn.Module):
                     best_ratio = ratio
         return best_ratio
 
+    def get_target_aspect_ratio(self, width, height, min_num=1, max_num=12, image_size=448):
+        """
+        Returns the (columns, rows) of tiles closest to the aspect ratio of the frames, computed once per resolution
+        """
+        key = (width, height, min_num, max_num, image_size)
+        if key not in self.aspect_ratios:
+            target_ratios = set(
+                (i, j) for n in range(min_num, max_num + 1) for i in range(1, n + 1) for j in range(1, n + 1) if
+                i * j <= max_num and i * j >= min_num)
+            target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
+            self.aspect_ratios[key] = self.find_closest_aspect_ratio(
+                width / height, target_ratios, width, height, image_size)
+
+        return self.aspect_ratios[key]
+
     def dynamic_preprocess(self, image, min_num=1, max_num=12, image_size=448, use_thumbnail=False):
         orig_width, orig_height = image.size
-        aspect_ratio = orig_width / orig_height
-
-        # calculate the existing image aspect ratio
-        target_ratios = set(
-            (i, j) for n in range(min_num, max_num + 1) for i in range(1, n + 1) for j in range(1, n + 1) if
-            i * j <= max_num and i * j >= min_num)
-        target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
 
         # find the closest aspect ratio to the target
-        target_aspect_ratio = self.find_closest_aspect_ratio(
-            aspect_ratio, target_ratios, orig_width, orig_height, image_size)
+        target_aspect_ratio = self.get_target_aspect_ratio(orig_width, orig_height, min_num, max_num, image_size)
 
         # calculate the target width and height
         target_width = image_size * target_aspect_ratio[0]
@@ -73,13 +91,52 @@ class InternVL25VisualProcessor(nn.Module):
             processed_images.append(thumbnail_img)
         return processed_images
 
+    def resize(self, x, size):
+        # Bicubic resampling of uint8 frames with antialiasing as in PIL, which is fastest in channels-last layout
+        x = x.contiguous(memory_format=torch.channels_last)
+        return F.interpolate(x, size=size, mode="bicubic", align_corners=False, antialias=True)
+
     def forward(self, x):
+        """
+        Tiles and normalizes frames of shape (T, C, H, W) in uint8 as a batch, numerically comparable to `forward_pil`
+
+        Returns:
+            pixel_values (torch.Tensor) : Tiles of all frames of shape (T * N, C, image_size, image_size), with N tiles per frame
+            num_patches_list (list) : Number of tiles N of each frame
+        """
+        num_frames, _, height, width = x.shape
+        image_size = self.image_size
+        if x.is_floating_point(): # Frames in [0, 1], quantized as by `ToPILImage`
+            x = x.mul(255).byte()
+
+        columns, rows = self.get_target_aspect_ratio(width, height, self.min_num, self.max_num, image_size)
+        tiles = x
+        if (rows * image_size, columns * image_size) != (height, width):
+            tiles = self.resize(x, (rows * image_size, columns * image_size))
+        # (T, C, rows * S, columns * S) -> (T, rows * columns, C, S, S), with tiles in row-major order
+        tiles = tiles.view(num_frames, 3, rows, image_size, columns, image_size).permute(0, 2, 4, 1, 3, 5)
+        tiles = tiles.reshape(num_frames, rows * columns, 3, image_size, image_size)
+        if self.use_thumbnail and rows * columns != 1:
+            thumbnails = self.resize(x, (image_size, image_size)) if (height, width) != (image_size, image_size) else x
+            tiles = torch.cat([tiles, thumbnails.unsqueeze(1)], dim=1)
+
+        num_patches_list = [tiles.shape[1]] * num_frames
+        pixel_values = tiles.flatten(0, 1).float() * self.scale.to(x.device) - self.shift.to(x.device)
+
+        return pixel_values, num_patches_list
+
+    def forward_pil(self, x):
+        """
+        Reference implementation of `forward`, processing each frame as a PIL image
+        """
         pixel_values_list, num_patches_list = [], []
-        transform = self.build_transform()
+        transform = self.build_transform(input_size=self.image_size)
         to_pil_image = T.ToPILImage()
         for frame in x:
             img = to_pil_image(frame).convert('RGB')
-            img = self.dynamic_preprocess(img, use_thumbnail=True, max_num=1)
+            img = self.dynamic_preprocess(
+                img, min_num=self.min_num, max_num=self.max_num, image_size=self.image_size, use_thumbnail=self.use_thumbnail
+            )
             pixel_values = torch.stack([transform(tile) for tile in img])
             num_patches_list.append(pixel_values.shape[0])
             pixel_values_list.append(pixel_values)
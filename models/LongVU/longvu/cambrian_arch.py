@@ -443,6 +443,39 @@ def unpad_image(tensor, original_size):
     return unpadded_tensor
 
 
+def select_frame_indices(frame_features, window_size=16, threshold=0.83):
+    """
+    Indices of the frames kept by the DINO temporal reduction of a video.
+
+    Args:
+    frame_features (torch.Tensor): DINO features of the frames, of shape (T, ...).
+    window_size (int): Frames are compared within consecutive windows of this size, the last window holding the remaining frames.
+    threshold (float): Frames whose mean cosine similarity to their window is below the threshold are kept, as is the middle frame of each window.
+
+    Returns:
+    torch.Tensor: Sorted indices of the kept frames.
+    """
+    num_frames = len(frame_features)
+    num_windows = math.ceil(num_frames / window_size)
+    frame_features = frame_features.flatten(1)
+    # Features are normalised straight into the padded batch, whose zero padding adds nothing to the similarity sums
+    query_feature = frame_features.new_empty((num_windows * window_size, frame_features.shape[1]))
+    query_feature[num_frames:] = 0
+    torch.div(frame_features, torch.norm(frame_features, dim=1, keepdim=True), out=query_feature[:num_frames])
+    query_feature = query_feature.view(num_windows, window_size, -1)
+
+    positions = torch.arange(num_windows * window_size, device=frame_features.device)
+    positions = positions.view(num_windows, window_size)
+    window_lengths = (num_frames - positions[:, :1]).clamp(max=window_size)
+    valid = positions < num_frames
+
+    similarities = torch.bmm(query_feature, query_feature.transpose(1, 2))
+    similarities = (similarities.float().sum(dim=2) / window_lengths).to(similarities.dtype)
+    similarities[positions - positions[:, :1] == window_lengths // 2] = 0
+
+    return positions[(similarities < threshold) & valid]
+
+
 class CambrianMetaForCausalLM(ABC):
 
     @abstractmethod
@@ -711,68 +744,27 @@ class CambrianMetaForCausalLM(ABC):
                 selected_frame_indices_all.append(torch.arange(len(frame_features)))
                 continue
 
-            num_segments = len(frame_features) // window_size
-            if num_segments == 0:
-                query_feature = frame_features.flatten(1, 2)
-                query_feature = query_feature / torch.norm(
-                    (query_feature), dim=1, keepdim=True
-                )
-                similarities = torch.mean(query_feature @ query_feature.T, dim=1)
-                similarities[len(frame_features) // 2] = 0
-                indices = torch.where(similarities < threshold)[0]
-                selected_frame_indices_all.append(indices)
-                selected_frames_all_0.append(new_image_aux_batch_0[i_batch][indices])
-                selected_frames_all_1.append(new_image_aux_batch_1[i_batch][indices])
-                selected_frames_feature_all.append(frame_features[indices])
-                new_split_sizes.append(len(indices))
-                continue
-            segments_frames_0 = []
-            segments_frames_1 = []
-            segments_features = []
-            for start_idx in range(0, len(frame_features), window_size):
-                end_idx = min(start_idx + window_size, len(frame_features))
-                segments_frames_0.append(
-                    new_image_aux_batch_0[i_batch][start_idx:end_idx]
-                )
-                segments_frames_1.append(
-                    new_image_aux_batch_1[i_batch][start_idx:end_idx]
-                )
-                segments_features.append(frame_features[start_idx:end_idx])
-            selected_frames_0 = []
-            selected_frames_1 = []
-            selected_features = []
-            selected_frame_indices = []
-            for i, segment in enumerate(segments_features):
-                query_feature = segment.flatten(1, 2)
-                query_feature = query_feature / torch.norm(
-                    (query_feature), dim=1, keepdim=True
-                )
-                similarities = torch.mean(query_feature @ query_feature.T, dim=1)
-                similarities[len(segment) // 2] = 0
-                indices = torch.where(similarities < threshold)[0]
-                selected_frames_0.append(segments_frames_0[i][indices])
-                selected_frames_1.append(segments_frames_1[i][indices])
-                selected_features.append(segment[indices])
-                selected_frame_indices.extend(indices + i * window_size)
-            selected_frames_0 = torch.cat(selected_frames_0, dim=0)
-            selected_frames_1 = torch.cat(selected_frames_1, dim=0)
-            selected_features = torch.cat(selected_features, dim=0)
-            selected_frame_indices = torch.tensor(selected_frame_indices)
+            selected_frame_indices = select_frame_indices(
+                frame_features, window_size=window_size, threshold=threshold
+            )
             # ablation
             max_num_frames = 400  # in case of OOM
-            if len(selected_frames_0) > max_num_frames:
-                interval = len(selected_frames_0) / float(max_num_frames)
-                indices = [int(interval * i) for i in range(max_num_frames)]
-                new_split_sizes.append(len(indices))
-                selected_frames_all_0.append(selected_frames_0[indices])
-                selected_frames_all_1.append(selected_frames_1[indices])
-                selected_frames_feature_all.append(selected_features[indices])
-                selected_frame_indices = selected_frame_indices[indices]
-            else:
-                new_split_sizes.append(len(selected_frames_0))
-                selected_frames_all_0.append(selected_frames_0)
-                selected_frames_all_1.append(selected_frames_1)
-                selected_frames_feature_all.append(selected_features)
+            if len(selected_frame_indices) > max_num_frames:
+                interval = len(selected_frame_indices) / float(max_num_frames)
+                indices = (
+                    interval * torch.arange(max_num_frames, dtype=torch.float64)
+                ).long()
+                selected_frame_indices = selected_frame_indices[
+                    indices.to(selected_frame_indices.device)
+                ]
+            new_split_sizes.append(len(selected_frame_indices))
+            selected_frames_all_0.append(
+                new_image_aux_batch_0[i_batch][selected_frame_indices]
+            )
+            selected_frames_all_1.append(
+                new_image_aux_batch_1[i_batch][selected_frame_indices]
+            )
+            selected_frames_feature_all.append(frame_features[selected_frame_indices])
             selected_frame_indices_all.append(selected_frame_indices)
         selected_frames_all_0 = torch.cat(selected_frames_all_0, dim=0)
         selected_frames_all_1 = torch.cat(selected_frames_all_1, dim=0)
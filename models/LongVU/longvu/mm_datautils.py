@@ -10,6 +10,7 @@ import numpy as np
 import tokenizers
 
 import torch
+import torch.nn.functional as F
 
 import transformers
 
@@ -265,7 +266,7 @@ def expand2square(pil_img, background_color):
 
 # pyre-fixme[3]: Return type must be annotated.
 # pyre-fixme[2]: Parameter must be annotated.
-def process_images(images, image_processor, model_cfg):
+def process_images(images, image_processor, model_cfg, device="cuda", dtype=torch.float16):
     if isinstance(image_processor, list):
         processor_aux_list = image_processor
         new_images_aux_list = []
@@ -292,7 +293,7 @@ def process_images(images, image_processor, model_cfg):
             list(batch_image_aux) for batch_image_aux in zip(*new_images_aux_list)
         ]
         new_images_aux_list = [
-            torch.stack(image_aux).half().cuda() for image_aux in new_images_aux_list
+            torch.stack(image_aux).to(device=device, dtype=dtype) for image_aux in new_images_aux_list
         ]
         return new_images_aux_list
     else:
@@ -314,6 +315,81 @@ def process_images(images, image_processor, model_cfg):
         return new_images
 
 
+def get_processor_resolution(processor_aux):
+    try:
+        return processor_aux.crop_size["height"]
+    except:
+        return processor_aux.size["height"]
+
+
+def supports_batched_processing(processor_aux):
+    """
+    Whether `preprocess` of the auxiliary processor reduces to rescaling and normalizing images already padded to square
+    and resized to its resolution by `process_images`, i.e. its resizing and cropping are no-ops on such images
+    """
+    if not hasattr(processor_aux, "image_mean"):
+        return False
+    resolution = get_processor_resolution(processor_aux)
+    size = getattr(processor_aux, "size", None) or {}
+    if getattr(processor_aux, "do_resize", False) and resolution not in [size.get("height"), size.get("shortest_edge")]:
+        return False
+    if getattr(processor_aux, "do_center_crop", False) and processor_aux.crop_size["height"] != resolution:
+        return False
+
+    return True
+
+
+def process_images_batched(frames, image_processor, model_cfg, device="cuda", dtype=torch.float16):
+    """
+    Batched counterpart of `process_images` for frames of shape (T, C, H, W) in uint8, padding frames to square, resizing and
+    normalizing them for all auxiliary vision towers as tensors on `device`, instead of one PIL image at a time.
+    Falls back to `process_images` for processors whose preprocessing does not reduce to these steps.
+
+    Returns:
+        images_aux_list (list) : Frames of shape (T, C, R, R) for each auxiliary processor, with R its resolution
+    """
+    if not isinstance(image_processor, list) or not all(supports_batched_processing(x) for x in image_processor):
+        return process_images(
+            [frame.permute(1, 2, 0).cpu().numpy() for frame in frames], image_processor, model_cfg, device=device, dtype=dtype
+        )
+
+    frames = frames.to(device)
+    num_frames, num_channels, height, width = frames.shape
+    side = max(height, width)
+    images_aux_list = []
+    for processor_aux in image_processor:
+        mean = torch.tensor(processor_aux.image_mean, device=device).view(1, -1, 1, 1)
+        std = torch.tensor(processor_aux.image_std, device=device).view(1, -1, 1, 1)
+        # Pad to square with the mean color, centered as in `expand2square`
+        background = torch.tensor([int(x * 255) for x in processor_aux.image_mean], dtype=frames.dtype, device=device)
+        images = background.view(1, -1, 1, 1).repeat(num_frames, 1, side, side)
+        top, left = (side - height) // 2, (side - width) // 2
+        images[:, :, top:top + height, left:left + width] = frames
+
+        resolution = get_processor_resolution(processor_aux)
+        if side != resolution:
+            # Antialiased bicubic resizing as in PIL, in uint8 on CPU (fastest in channels-last layout)
+            if images.device.type == "cpu":
+                images = F.interpolate(
+                    images.contiguous(memory_format=torch.channels_last), size=(resolution, resolution),
+                    mode="bicubic", align_corners=False, antialias=True
+                )
+            else:
+                images = F.interpolate(
+                    images.float(), size=(resolution, resolution), mode="bicubic", align_corners=False, antialias=True
+                ).round_().clamp_(0, 255)
+
+        # Rescaling and normalization fused into a single multiply-subtract
+        rescale_factor = processor_aux.rescale_factor if getattr(processor_aux, "do_rescale", True) else 1
+        if getattr(processor_aux, "do_normalize", True):
+            images = images.float() * (rescale_factor / std) - mean / std
+        else:
+            images = images.float() * rescale_factor
+        images_aux_list.append(images.contiguous().to(dtype=dtype))
+
+    return images_aux_list
+
+
 # pyre-fixme[2]: Parameter must be annotated.
 # pyre-fixme[24]: Generic type `dict` expects 2 type parameters, use
 #  `typing.Dict[<key type>, <value type>]` to avoid runtime subscripting errors.
@@ -1,25 +1,30 @@
 from torch import nn
 import torch
-import numpy as np
 
-from ..longvu.mm_datautils import process_images
+from ..longvu.mm_datautils import process_images, process_images_batched
 
 class LongVUVisualProcessor(nn.Module):
-    def __init__(self, image_processor, model_config, *args, **kwargs) -> None:
+    def __init__(self, image_processor, model_config, device="cpu", dtype=torch.float16, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
 
         self.image_processor = image_processor
         self.model_config = model_config
+        # Frames are processed on CPU by default, as the processor may run in DataLoader workers (see `--num_workers`),
+        # and are moved to the device of the model by the inference pipeline
+        self.device = device
+        self.dtype = dtype
 
     def __call__(self, video, *args, **kwargs):
         """
         Process the video frames for LongVU model.
         """
         if isinstance(video, torch.Tensor):
-            video = np.stack([x.permute(1, 2, 0).numpy() for x in video])
-
-        image_sizes = [video[0].shape[:2]]
-        video = process_images(video, self.image_processor, self.model_config)
+            # Frames of shape (T, C, H, W) are processed as a batch
+            image_sizes = [tuple(video.shape[2:])]
+            video = process_images_batched(video, self.image_processor, self.model_config, device=self.device, dtype=self.dtype)
+        else:
+            image_sizes = [video[0].shape[:2]]
+            video = process_images(video, self.image_processor, self.model_config, device=self.device, dtype=self.dtype)
         video = [frame.unsqueeze(0) for frame in video]
 
         return video, image_sizes
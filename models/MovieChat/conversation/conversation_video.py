@@ -4,9 +4,7 @@ Adapted from: https://github.com/Vision-CAIR/MiniGPT-4/blob/main/minigpt4/conver
 """
 import os
 import torch
-import numpy as np
 import decord
-import subprocess
 from decord import VideoReader
 from moviepy.editor import *
 from transformers import StoppingCriteria, StoppingCriteriaList
@@ -16,6 +14,8 @@ from enum import auto, Enum
 from typing import List, Any
 import os
 from models.MovieChat.common.registry import registry
+from frames import get_video_metadata
+from utils import get_frame_indices
 from models.MovieChat.processors import Blip2ImageEvalProcessor
             
 class SeparatorStyle(Enum):
@@ -156,21 +156,16 @@ class Chat:
         return fragment_video
     
     def video_duration(self, filename):
-        result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
-                                "format=duration", "-of",
-                                "default=noprint_wrappers=1:nokey=1", filename],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        return float(result.stdout)
+        # Read from the shared metadata index, in place of running ffprobe for every question
+        return get_video_metadata(filename)["duration"]
     
     def load_video(self, video_path, n_frms=4, height=-1, width=-1):
         decord.bridge.set_bridge("torch")
         vr = VideoReader(uri=video_path, height=height, width=width)
         vlen = len(vr)
-        start, end = 0, vlen
 
         n_frms = min(n_frms, vlen)
-        indices = np.arange(start, end, vlen / n_frms).astype(int).tolist()
+        indices = get_frame_indices(n_frms, vlen, sample="uniform").tolist()
 
         # get_batch -> T, H, W, C
         temp_frms = vr.get_batch(indices)
@@ -183,6 +178,37 @@ class Chat:
         msg = f"The video contains {len(indices)} frames sampled at {sec} seconds. "
         return frms, msg
 
+    def get_fragment_frame_indices(self, vlen, fps, video_length, num_fragments, n_frms=4):
+        """
+        Returns the indices of the frames sampled from each fragment of the video, matching the sampling of `load_video`
+        on fragments of `video_length / n_samples` seconds cut with `parse_video_fragment`
+        """
+        per_video_length = video_length / self.n_samples
+        fragment_indices = []
+        for n_stage in range(num_fragments):
+            start = min(int(n_stage * per_video_length * fps), vlen - 1)
+            end = min(max(int((n_stage + 1) * per_video_length * fps), start + 1), vlen)
+            fragment_length = end - start
+            fragment_indices.append((start + get_frame_indices(n_frms, fragment_length, sample="uniform")).tolist())
+
+        return fragment_indices
+
+    def load_video_fragments(self, video_path, video_length, num_fragments, n_frms=4, height=-1, width=-1):
+        """
+        Samples the frames of the first `num_fragments` fragments of the video in a single decoding pass, without writing fragments to disk.
+
+        Returns:
+            fragments (list) : Frames of each fragment, each of shape (C, T, H, W)
+        """
+        decord.bridge.set_bridge("torch")
+        vr = VideoReader(uri=video_path, height=height, width=width)
+        fragment_indices = self.get_fragment_frame_indices(len(vr), float(vr.get_avg_fps()), video_length, num_fragments, n_frms=n_frms)
+
+        frames = vr.get_batch([index for indices in fragment_indices for index in indices])
+        frames = frames.permute(3, 0, 1, 2).float() # (C, T, H, W)
+
+        return list(torch.split(frames, [len(indices) for indices in fragment_indices], dim=1))
+
     def get_context_emb(self, input_text, img_list):
         prompt_1 = "You are able to understand the visual content that the user provides.Follow the instructions carefully and explain your answers.###Human: <Video><ImageHere></Video>"
         prompt_2 = input_text
@@ -266,38 +292,20 @@ class Chat:
     ):
         video_length = self.video_duration(video_path) 
         num_frames, cur_frame = self.cal_frame(video_length, cur_min, cur_sec, middle_video)
-        
-        if num_frames == 0:
-            video_fragment = self.parse_video_fragment(
-                video_path=video_path, fragment_video_path=fragment_video_path,
-                video_length=video_length, n_stage=0, n_samples=self.n_samples)
-            video_fragment, _ = self.load_video(
-                video_path=fragment_video_path,
-                n_frms=self.vis_processor.n_frms, 
-                height=224,
-                width=224,
-            ) 
-            video_fragment = self.vis_processor.transform(video_fragment)
-            video_fragment = video_fragment.unsqueeze(0).to(self.device)
-            self.model.encode_short_memory_frame(video_fragment, cur_frame)
-        else:
-            for i in range(num_frames): 
-                video_fragment = self.parse_video_fragment(
-                    video_path=video_path, fragment_video_path=fragment_video_path,
-                    video_length=video_length, n_stage=i)
-                video_fragment, _ = self.load_video(
-                    video_path=fragment_video_path,
-                    n_frms=self.vis_processor.n_frms, 
-                    height=224,
-                    width=224
-                )
-                video_fragment = self.vis_processor.transform(video_fragment) 
-                video_fragment = video_fragment.unsqueeze(0).to(self.device)
-
-                if middle_video and (i + 1)==num_frames:
-                    self.model.encode_short_memory_frame(video_fragment, cur_frame)
-                else:
-                    self.model.encode_short_memory_frame(video_fragment)
+
+        # Frames of all fragments are sampled up front, in place of re-encoding each fragment to `fragment_video_path` and decoding it
+        video_fragments = self.load_video_fragments(
+            video_path=video_path, video_length=video_length, num_fragments=max(num_frames, 1),
+            n_frms=self.vis_processor.n_frms, 
+            height=224,
+            width=224
+        )
+        video_fragments = [self.vis_processor.transform(video_fragment).unsqueeze(0) for video_fragment in video_fragments]
+        n_frames = [
+            cur_frame if num_frames == 0 or (middle_video and (i + 1) == num_frames) else 16 for i in range(len(video_fragments))
+        ]
+        # Frames of all fragments are encoded in large batches, before being loaded into the short-term memory fragment by fragment
+        self.model.encode_short_memory_frames(video_fragments, n_frames=n_frames, device=self.device)
 
         video_emb, _ = self.model.encode_long_video(cur_image, middle_video)
 
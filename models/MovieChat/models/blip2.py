@@ -45,8 +45,9 @@ class Blip2Base(BaseModel):
             return contextlib.nullcontext()
 
     @classmethod
-    def init_Qformer(cls, num_query_token, vision_width, cross_attention_freq=2):
-        encoder_config = BertConfig.from_pretrained("bert-base-uncased")
+    def init_Qformer(cls, num_query_token, vision_width, cross_attention_freq=2, bert_config=None):
+        # BERT config of the Q-Former, bert-base-uncased unless provided (e.g. small random models)
+        encoder_config = BertConfig(**bert_config) if bert_config is not None else BertConfig.from_pretrained("bert-base-uncased")
         encoder_config.encoder_width = vision_width
         # insert cross-attention layer every other block
         encoder_config.add_cross_attention = True
@@ -61,11 +62,11 @@ class Blip2Base(BaseModel):
 
     @classmethod
     def init_vision_encoder(
-        cls, model_name, img_size, drop_path_rate, use_grad_checkpoint, precision
+        cls, model_name, img_size, drop_path_rate, use_grad_checkpoint, precision, pretrained=True, **vit_config
     ):
         assert model_name == "eva_clip_g", "vit model must be eva_clip_g for current version of MiniGPT-4"
         visual_encoder = create_eva_vit_g(
-            img_size, drop_path_rate, use_grad_checkpoint, precision
+            img_size, drop_path_rate, use_grad_checkpoint, precision, pretrained=pretrained, **vit_config
         )
 
         ln_vision = LayerNorm(visual_encoder.num_features)
@@ -8,7 +8,7 @@ import torch.nn as nn
 from models.MovieChat.common.registry import registry
 from models.MovieChat.models.blip2 import Blip2Base, disabled_train
 from models.MovieChat.models.modeling_llama import LlamaForCausalLM
-from transformers import LlamaTokenizer, BertConfig, BitsAndBytesConfig
+from transformers import LlamaTokenizer, LlamaConfig, BertConfig, BitsAndBytesConfig
 import einops
 import copy
 from models.MovieChat.models.Qformer import BertConfig, BertLMHeadModel
@@ -32,8 +32,8 @@ class MovieChat(Blip2Base):
     }
 
     @classmethod
-    def init_video_Qformer(cls, num_query_token, vision_width,num_hidden_layers =2):
-        encoder_config = BertConfig.from_pretrained("bert-base-uncased")
+    def init_video_Qformer(cls, num_query_token, vision_width,num_hidden_layers =2, bert_config=None):
+        encoder_config = BertConfig(**bert_config) if bert_config is not None else BertConfig.from_pretrained("bert-base-uncased")
         encoder_config.num_hidden_layers = num_hidden_layers
         encoder_config.encoder_width = vision_width
         # insert cross-attention layer every other block
@@ -77,14 +77,18 @@ class MovieChat(Blip2Base):
         short_memory_merge = 2,
         Qformer_input = 8,
         n_position = 16,
+        random_init = False, # Randomly initialise all weights without loading any pretrained weights or tokenizers (e.g. for CPU benchmarks)
+        vit_config = None, # Overrides of the EVA ViT-g architecture (e.g. embed_dim, depth, num_heads)
+        qformer_config = None, # BERT config of both Q-Formers, bert-base-uncased if None
+        llama_config = None, # LlamaConfig of the randomly initialised LLM, required if random_init
     ):
         super().__init__()
 
-        self.tokenizer = self.init_tokenizer()
+        self.tokenizer = self.init_tokenizer() if not random_init else None
         self.low_resource = low_resource
 
         self.visual_encoder, self.ln_vision = self.init_vision_encoder(
-            vit_model, img_size, drop_path_rate, use_grad_checkpoint, vit_precision
+            vit_model, img_size, drop_path_rate, use_grad_checkpoint, vit_precision, pretrained=not random_init, **(vit_config or {})
         )
         if freeze_vit:
             for name, param in self.visual_encoder.named_parameters():
@@ -97,7 +101,7 @@ class MovieChat(Blip2Base):
             self.ln_vision.train = disabled_train
 
         self.Qformer, self.query_tokens = self.init_Qformer(
-            num_query_token, self.visual_encoder.num_features
+            num_query_token, self.visual_encoder.num_features, bert_config=qformer_config
         )
         self.Qformer.cls = None
         self.Qformer.bert.embeddings.word_embeddings = None
@@ -105,7 +109,8 @@ class MovieChat(Blip2Base):
         for layer in self.Qformer.bert.encoder.layer:
             layer.output = None
             layer.intermediate = None
-        self.load_from_pretrained(url_or_filename=q_former_model)
+        if not random_init:
+            self.load_from_pretrained(url_or_filename=q_former_model)
 
         if freeze_qformer:
             for name, param in self.Qformer.named_parameters():
@@ -114,18 +119,25 @@ class MovieChat(Blip2Base):
             self.Qformer.train = disabled_train
             self.query_tokens.requires_grad = False
 
-        self.llama_tokenizer = LlamaTokenizer.from_pretrained(llama_model, use_fast=False)
-        if self.llama_tokenizer.pad_token is None:
-            self.llama_tokenizer.pad_token = self.llama_tokenizer.eos_token 
-        DEFAULT_IMAGE_PATCH_TOKEN = '<ImageHere>'
-        DEFAULT_AUDIO_PATCH_TOKEN = '<AudioHere>'
-        self.llama_tokenizer.add_tokens([DEFAULT_IMAGE_PATCH_TOKEN], special_tokens=True)
-        self.llama_tokenizer.add_tokens([DEFAULT_AUDIO_PATCH_TOKEN], special_tokens=True)
-        
-        self.IMAGE_PATCH_TOKEN_ID = self.llama_tokenizer.get_vocab()[DEFAULT_IMAGE_PATCH_TOKEN]
-        self.AUDIO_PATCH_TOKEN_ID = self.llama_tokenizer.get_vocab()[DEFAULT_AUDIO_PATCH_TOKEN]
+        if random_init:
+            # No tokenizer, only the visual memory path and LLM embeddings are usable
+            self.llama_tokenizer = None
+            self.IMAGE_PATCH_TOKEN_ID = self.AUDIO_PATCH_TOKEN_ID = None
+        else:
+            self.llama_tokenizer = LlamaTokenizer.from_pretrained(llama_model, use_fast=False)
+            if self.llama_tokenizer.pad_token is None:
+                self.llama_tokenizer.pad_token = self.llama_tokenizer.eos_token 
+            DEFAULT_IMAGE_PATCH_TOKEN = '<ImageHere>'
+            DEFAULT_AUDIO_PATCH_TOKEN = '<AudioHere>'
+            self.llama_tokenizer.add_tokens([DEFAULT_IMAGE_PATCH_TOKEN], special_tokens=True)
+            self.llama_tokenizer.add_tokens([DEFAULT_AUDIO_PATCH_TOKEN], special_tokens=True)
+            
+            self.IMAGE_PATCH_TOKEN_ID = self.llama_tokenizer.get_vocab()[DEFAULT_IMAGE_PATCH_TOKEN]
+            self.AUDIO_PATCH_TOKEN_ID = self.llama_tokenizer.get_vocab()[DEFAULT_AUDIO_PATCH_TOKEN]
 
-        if self.low_resource:
+        if random_init:
+            self.llama_model = LlamaForCausalLM(LlamaConfig(**llama_config))
+        elif self.low_resource:
             print(f"Using low resource...")
             # NOTE: Modified to use BnB 4bit instead
             quantization_config = BitsAndBytesConfig(
@@ -179,7 +191,7 @@ class MovieChat(Blip2Base):
 
         self.num_video_query_token = num_video_query_token
         self.video_Qformer,self.video_query_tokens = self.init_video_Qformer(num_query_token = num_video_query_token,\
-            vision_width=self.Qformer.config.hidden_size, num_hidden_layers =2)
+            vision_width=self.Qformer.config.hidden_size, num_hidden_layers =2, bert_config=qformer_config)
 
         self.video_Qformer.cls = None
         self.video_Qformer.bert.embeddings.word_embeddings = None
@@ -209,6 +221,7 @@ class MovieChat(Blip2Base):
         self.short_memory_buffer = []
         self.short_memory_merge = short_memory_merge 
         self.temp_short_memory = []
+        self.encode_chunk_size = 256 # Maximum number of frames encoded at once by `encode_short_memory_frames`
 
         self.long_memory_length = long_memory_length 
         self.long_memory_buffer = []
@@ -256,14 +269,17 @@ class MovieChat(Blip2Base):
         self.visual_encoder.to("cpu")
         self.visual_encoder.float()
 
-    def encode_short_memory_frame(self, videofragment, n_frame:int = 16):
-        device = videofragment.device
-        # input shape b,c,t,h,w
-        batch_size,_,time_length,_,_ = videofragment.size() # batch_size:1 time_length:8
-        videofragment = einops.rearrange(videofragment, 'b c t h w -> (b t) c h w') 
+    def encode_frames_qformer(self, frames):
+        """
+        Encodes frames of shape (N, C, H, W) with the image encoder and Q-Former, returning the query hidden states of shape (N, Q, D)
+        """
+        # Frames follow the device and dtype of the image encoder, and its embeddings the device of the Q-Former (e.g. after `vit_to_cpu`)
+        vit_parameter = next(self.visual_encoder.parameters())
+        frames = frames.to(device=vit_parameter.device, dtype=vit_parameter.dtype)
+        device = self.query_tokens.device
         with self.maybe_autocast():
             # embed image features with blip2, out: (b t) q h
-            image_embeds = self.ln_vision(self.visual_encoder(videofragment)).to(device) 
+            image_embeds = self.ln_vision(self.visual_encoder(frames)).to(device) 
             image_atts = torch.ones(image_embeds.size()[:-1], dtype=torch.long).to(device)
 
             query_tokens = self.query_tokens.expand(image_embeds.shape[0], -1, -1)
@@ -274,9 +290,15 @@ class MovieChat(Blip2Base):
                 return_dict=True,
             )
 
+        return query_output.last_hidden_state
+
+    def update_short_memory(self, q_hidden_state, n_frame:int = 16):
+        """
+        Loads the encoded frames of a video fragment into the short-term memory, which is merged and consolidated into the long-term memory
+        """
+        with self.maybe_autocast():
             # load short_memory_buffer
             cur_frame = 0
-            q_hidden_state = query_output.last_hidden_state 
             for frame in q_hidden_state:
                 if cur_frame < n_frame:
                     if len(self.short_memory_buffer) == self.short_memory_length:
@@ -287,35 +309,71 @@ class MovieChat(Blip2Base):
             self.temp_short_memory = []
             for i in self.short_memory_buffer:
                 self.temp_short_memory.append(i)
-            
-            #merge short_memory_frames
-            similar_list = []
-            for frame_i in range(len(self.short_memory_buffer) -1):
-                scores = self.short_memory_buffer[frame_i] @ self.short_memory_buffer[frame_i+1].transpose(-1, -2)
-                frame_silimar = torch.mean(scores)
-                similar_list.append(frame_silimar)
-            
-
-            while len(self.short_memory_buffer) > self.short_memory_merge:
-                max_value = max(similar_list)
-                max_index = similar_list.index(max_value)
-                new_frame_feature = (self.short_memory_buffer[max_index].cpu()+self.short_memory_buffer[max_index+1].cpu())/2
-                self.short_memory_buffer[max_index] = new_frame_feature.cuda()
-                del(self.short_memory_buffer[max_index+1])
-                similar_list = []
-                for frame_i in range(len(self.short_memory_buffer)-1):
-                    scores = self.short_memory_buffer[frame_i] @ self.short_memory_buffer[frame_i+1].transpose(-1, -2)
-                    frame_silimar = torch.mean(scores)
-                    similar_list.append(frame_silimar)
+        
+            #merge short_memory_frames, kept stacked on the device with one similarity per adjacent pair of frames
+            if len(self.short_memory_buffer) > self.short_memory_merge:
+                buffer = torch.stack(self.short_memory_buffer) # (L, Q, D)
+                similarities = torch.mean(buffer[:-1] @ buffer[1:].transpose(-1, -2), dim=(-2, -1))
+                while buffer.shape[0] > self.short_memory_merge:
+                    max_index = similarities.argmax().item() # First maximum on ties, as with list.index
+                    new_frame_feature = (buffer[max_index] + buffer[max_index + 1]) / 2
+                    buffer = torch.cat([buffer[:max_index], new_frame_feature.unsqueeze(0), buffer[max_index + 2:]], dim=0)
+                    # Only the similarities of the merged frame with its neighbours change
+                    neighbours = buffer[max(max_index - 1, 0):max_index + 2]
+                    similarities = torch.cat([
+                        similarities[:max(max_index - 1, 0)],
+                        torch.mean(neighbours[:-1] @ neighbours[1:].transpose(-1, -2), dim=(-2, -1)),
+                        similarities[max_index + 2:]
+                    ], dim=0)
+                self.short_memory_buffer = list(buffer.unbind(0))
 
             for frame in self.short_memory_buffer:
                 self.long_memory_buffer.append(frame)
-            
+        
             self.short_memory_buffer = []
 
+    def encode_short_memory_frame(self, videofragment, n_frame:int = 16):
+        # input shape b,c,t,h,w
+        videofragment = einops.rearrange(videofragment, 'b c t h w -> (b t) c h w') 
+        self.update_short_memory(self.encode_frames_qformer(videofragment), n_frame=n_frame)
+
+    def encode_short_memory_frames(self, videofragments, n_frames=None, device=None):
+        """
+        Batched counterpart of calling `encode_short_memory_frame` on each of `videofragments` in order. Frames of all fragments
+        are encoded in chunks of up to `encode_chunk_size` frames (halved whenever out of memory), after which the short-term 
+        memory is updated sequentially with the encoded frames of each fragment.
+
+        Args:
+            videofragments (list) : Fragments each of shape (1, C, T, H, W), on any device
+            n_frames (list) : `n_frame` argument of `encode_short_memory_frame` for each fragment
+            device : Device to encode frames on, defaults to the device of the visual encoder
+        """
+        if n_frames is None:
+            n_frames = [16] * len(videofragments)
+        if device is None:
+            device = next(self.visual_encoder.parameters()).device
+
+        frames = torch.cat([einops.rearrange(x, 'b c t h w -> (b t) c h w') for x in videofragments], dim=0)
+        q_hidden_states, start = [], 0
+        while start < len(frames):
+            try:
+                q_hidden_states.append(self.encode_frames_qformer(frames[start:start + self.encode_chunk_size].to(device)))
+                start += self.encode_chunk_size
+            except torch.cuda.OutOfMemoryError:
+                if self.encode_chunk_size == 1:
+                    raise
+                torch.cuda.empty_cache()
+                self.encode_chunk_size = max(self.encode_chunk_size // 2, 1)
+        q_hidden_states = torch.cat(q_hidden_states, dim=0)
+
+        lengths = [x.shape[0] * x.shape[2] for x in videofragments]
+        for q_hidden_state, n_frame in zip(torch.split(q_hidden_states, lengths, dim=0), n_frames):
+            self.update_short_memory(q_hidden_state, n_frame=n_frame)
+
     def encode_long_video(self, cur_image, middle_video:False):
         
-        device = 'cuda:0'
+        # Memory follows the device and dtype of the video Q-Former
+        device, dtype = self.video_query_tokens.device, self.video_query_tokens.dtype
         # input shape b,c,t,h,w
         batch_size = 1 # batch_size:1 
         self.long_memory_buffer = [i.unsqueeze(0) for i in self.long_memory_buffer]
@@ -356,7 +414,7 @@ class MovieChat(Blip2Base):
             frame_hidden_state = torch.cat(cur_video, dim=0)
             frame_hidden_state = einops.rearrange(frame_hidden_state, '(b t) q h -> b t q h', b=batch_size, t=len(video_features))
                 
-            frame_hidden_state = cur_position_embeddings + frame_hidden_state 
+            frame_hidden_state = cur_position_embeddings.to(device=device, dtype=dtype) + frame_hidden_state.to(device=device, dtype=dtype)
                 
             # frame attention
             frame_hidden_state =  einops.rearrange(frame_hidden_state, 'b t q h -> b (t q) h',b=batch_size,t=len(video_features)) 
@@ -390,7 +448,7 @@ class MovieChat(Blip2Base):
             frame_hidden_state = torch.cat(cur_video, dim=0) #[1,32,768]
             frame_hidden_state = einops.rearrange(frame_hidden_state, '(b t) q h -> b t q h', b=batch_size, t=len(self.long_memory_buffer)) #[64,32,768]
                 
-            frame_hidden_state = cur_position_embeddings.to(device) + frame_hidden_state.to(device)
+            frame_hidden_state = cur_position_embeddings.to(device=device, dtype=dtype) + frame_hidden_state.to(device=device, dtype=dtype)
                 
             # frame attention
             frame_hidden_state =  einops.rearrange(frame_hidden_state, 'b t q h -> b (t q) h',b=batch_size,t=len(self.long_memory_buffer)) 
@@ -413,23 +471,9 @@ class MovieChat(Blip2Base):
             return inputs_llama, atts_llama
 
     def encode_image(self, image):
-        device = 'cuda:0'
-
         image = einops.rearrange(image, 'b c t h w -> (b t) c h w') 
-        with self.maybe_autocast():
-            # embed image features with blip2, out: (b t) q h
-            image_embeds = self.ln_vision(self.visual_encoder(image)).to(device) 
-            image_atts = torch.ones(image_embeds.size()[:-1], dtype=torch.long).to(device)
-            query_tokens = self.query_tokens.expand(image_embeds.shape[0], -1, -1)
-            query_output = self.Qformer.bert(
-                query_embeds=query_tokens,
-                encoder_hidden_states=image_embeds,
-                encoder_attention_mask=image_atts,
-                return_dict=True,
-            )
-            q_hidden_state = query_output.last_hidden_state
 
-        return q_hidden_state
+        return self.encode_frames_qformer(image)
 
 
 
@@ -463,7 +507,7 @@ class MovieChat(Blip2Base):
                 max_value = max(similar_list)
                 max_index = similar_list.index(max_value)
                 new_frame_feature = (self.long_memory_buffer[max_index].cpu()+self.long_memory_buffer[max_index+1].cpu())/2
-                self.long_memory_buffer[max_index] = new_frame_feature.cuda()
+                self.long_memory_buffer[max_index] = new_frame_feature.to(device)
                 del(self.long_memory_buffer[max_index+1])
                 similar_list = []
                 for frame_i in range(len(self.long_memory_buffer)-1):
@@ -655,6 +699,11 @@ class MovieChat(Blip2Base):
         max_frame_pos = cfg.get("max_frame_pos", 32)
         fusion_head_layers = cfg.get("fusion_head_layers", 2)
         num_video_query_token =  cfg.get("num_video_query_token", 32)
+
+        random_init = cfg.get("random_init", False)
+        vit_config = dict(cfg.get("vit_config")) if cfg.get("vit_config") is not None else None
+        qformer_config = dict(cfg.get("qformer_config")) if cfg.get("qformer_config") is not None else None
+        llama_config = dict(cfg.get("llama_config")) if cfg.get("llama_config") is not None else None
         model = cls(
             vit_model=vit_model,
             q_former_model=q_former_model,
@@ -678,6 +727,10 @@ class MovieChat(Blip2Base):
             frozen_llama_proj=frozen_llama_proj,
             frozen_video_Qformer=frozen_video_Qformer,
             num_video_query_token=num_video_query_token,
+            random_init=random_init,
+            vit_config=vit_config,
+            qformer_config=qformer_config,
+            llama_config=llama_config,
         )
 
         ckpt_path = cfg.get("ckpt", "")  # load weights of MiniGPT-4
@@ -9,7 +9,6 @@ import torch
 from models.MovieChat.common.registry import registry
 from decord import VideoReader
 import decord
-import numpy as np
 from models.MovieChat.processors import transforms_video
 from models.MovieChat.processors.base_processor import BaseProcessor
 from models.MovieChat.processors.randaugment import VideoRandomAugment
@@ -18,6 +17,8 @@ from omegaconf import OmegaConf
 from torchvision import transforms
 import random as rnd
 
+from utils import get_frame_indices
+
 
 MAX_INT = registry.get("MAX_INT")
 decord.bridge.set_bridge("torch")
@@ -27,12 +28,11 @@ def load_video(video_path, n_frms=MAX_INT, height=-1, width=-1, sampling="unifor
     vr = VideoReader(uri=video_path, height=height, width=width)
 
     vlen = len(vr)
-    start, end = 0, vlen
 
     n_frms = min(n_frms, vlen)
 
     if sampling == "uniform":
-        indices = np.arange(start, end, vlen / n_frms).astype(int).tolist()
+        indices = get_frame_indices(n_frms, vlen, sample="uniform").tolist()
     elif sampling == "headtail":
         indices_h = sorted(rnd.sample(range(vlen // 2), n_frms // 2))
         indices_t = sorted(rnd.sample(range(vlen // 2, vlen), n_frms // 2))
@@ -169,7 +169,8 @@ class Videollama2MetaForCausalLM(ABC):
             #    attention_mask = torch.ones((attention_mask.shape[0], past_key_values[-1][-1].shape[-2] + 1), dtype=attention_mask.dtype, device=attention_mask.device)
             return input_ids, attention_mask, past_key_values, None, labels
 
-        mm_features = self.encode_images_or_videos(images)
+        # Pre-computed features from `encode_images_or_videos` (e.g. re-used across prompts on the same video) are used as-is
+        mm_features = images if isinstance(images, torch.Tensor) else self.encode_images_or_videos(images)
 
         new_input_embeds = []
         new_labels = [] if labels is not None else None
@@ -257,8 +258,12 @@ class Videollama2MetaForCausalLM(ABC):
                 new_labels  = torch.stack(new_labels, dim=0)
 
             if attention_mask is not None:
-                new_attn_mask_pad_left = torch.full((attention_mask.shape[0], new_input_embeds.shape[1] - input_ids.shape[1]), True, dtype=attention_mask.dtype, device=attention_mask.device)
-                attention_mask = torch.cat((new_attn_mask_pad_left, attention_mask), dim=1)
+                new_attn_mask_pad = torch.full((attention_mask.shape[0], new_input_embeds.shape[1] - input_ids.shape[1]), True, dtype=attention_mask.dtype, device=attention_mask.device)
+                # Left-padded batches: extend the mask on the right so that padding positions stay aligned with the embeddings
+                if attention_mask[:, -1].all() and not attention_mask[:, 0].all():
+                    attention_mask = torch.cat((attention_mask, new_attn_mask_pad), dim=1)
+                else:
+                    attention_mask = torch.cat((new_attn_mask_pad, attention_mask), dim=1)
                 assert attention_mask.shape == new_input_embeds.shape[:2]
 
         return None, attention_mask, past_key_values, new_input_embeds, new_labels
@@ -168,6 +168,26 @@ def build_cut_shape_indices(cut_shape):
         cut_shape_indices.append(indices)
     cut_shape_indices = torch.cat(cut_shape_indices,dim=0).long()
     return cut_shape_indices
+
+def resize_frames(frames, size, antialias=True):
+    """
+    Bicubic resizing of frames of shape (T, C, H, W) to size (h, w) in a single interpolate call. uint8 frames on CPU are resized
+    in uint8 and channels last, which is several times faster than `F.resize` and within one uint8 level of it on natural frames.
+    """
+    if frames.dtype == torch.uint8 and frames.device.type == "cpu":
+        frames = frames.contiguous(memory_format=torch.channels_last)
+        return torch.nn.functional.interpolate(frames, size=size, mode="bicubic", antialias=antialias).contiguous()
+    resized = torch.nn.functional.interpolate(frames.float(), size=size, mode="bicubic", antialias=antialias)
+    return resized.round().clamp(0, 255).to(frames.dtype) if frames.dtype == torch.uint8 else resized.to(frames.dtype)
+
+def stack_frames(images):
+    """
+    Stacks images given as tensors of shape (C, H, W) with the same resolution (e.g. the frames of a video) into a tensor of shape
+    (T, C, H, W), such that they are processed as a batch. Returns None for images of other types or resolutions.
+    """
+    if len(images) == 0 or not all(isinstance(image, torch.Tensor) and image.ndim == 3 and image.shape == images[0].shape for image in images):
+        return None
+    return torch.stack(list(images), dim=0)
     
 class AnchorResize(torch.nn.Module):
   
@@ -190,19 +210,16 @@ class AnchorResize(torch.nn.Module):
     def resize_global(self, img):
         return F.resize(img, self.image_size, self.interpolation, max_size=None, antialias=self.antialias)
 
-    def forward(self, img, skip_resize=False):
+    def select_anchor(self, input_image_size):
         """
         Args:
-            img (PIL Image or Tensor): Image to be scaled.
+            input_image_size (tuple): Size (h, w) of the image to be scaled.
 
         Returns:
-            PIL Image or Tensor: Rescaled image.
+            int: Index of the anchor selected for the image.
         """
         if self.anchor_strategy == 'docowl':
-            try:
-                selected_anchor = anchor_rank(self.anchors, self.anchor_areas, (img.size[1], img.size[0]))
-            except:
-                selected_anchor = anchor_rank(self.anchors, self.anchor_areas, (img.size(1), img.size(0)))
+            selected_anchor = anchor_rank(self.anchors, self.anchor_areas, input_image_size)
         elif self.anchor_strategy == 'random':
             selected_anchor = random.randint(0,len(self.anchors)-1)
         elif self.anchor_strategy == 'highest':
@@ -211,10 +228,22 @@ class AnchorResize(torch.nn.Module):
         elif self.anchor_strategy == 'last':
             selected_anchor = len(self.anchors)-1
         elif self.anchor_strategy == 'llava':
-            selected_anchor = select_best_resolution(self.anchors, self.anchor_areas, (img.size[1], img.size[0]))
+            selected_anchor = select_best_resolution(self.anchors, self.anchor_areas, input_image_size)
         else:
             selected_anchor = None
         assert selected_anchor is not None
+        return selected_anchor
+
+    def forward(self, img, skip_resize=False):
+        """
+        Args:
+            img (PIL Image or Tensor): Image to be scaled, or frames of shape (T, C, H, W) to be scaled with the same anchor.
+
+        Returns:
+            PIL Image or Tensor: Rescaled image.
+        """
+        input_image_size = tuple(img.shape[-2:]) if isinstance(img, torch.Tensor) else (img.size[1], img.size[0])
+        selected_anchor = self.select_anchor(input_image_size)
 
         target_size = self.anchors[selected_anchor][2:].tolist() # w,h
         if skip_resize:
@@ -281,6 +310,10 @@ class CutMixin:
 
 
     def _process_image(self, images):
+        frames = stack_frames(images) if self.resizer.anchor_strategy != 'random' else None
+        if frames is not None:
+            return self._process_frames(frames)
+
         new_images = []
         cut_shape = []
         for image in images:
@@ -301,6 +334,27 @@ class CutMixin:
         cut_shape_indices = build_cut_shape_indices(cut_shape)
         return new_images, cut_shape, cut_shape_indices
 
+    def _process_frames(self, frames):
+        """
+        Batched counterpart of `_process_image` for frames of shape (T, C, H, W), which share the same anchor. The anchor is selected
+        and the frames are resized once for all frames, and the cut shapes of one frame are repeated for the others.
+        """
+        num_frames = frames.shape[0]
+        antialias = bool(self.resizer.antialias) # None disables antialiasing of tensors, as in `F.resize`
+        selected_anchor = self.resizer.select_anchor(tuple(frames.shape[-2:]))
+        target_size = self.resizer.anchors[selected_anchor][2:].tolist() # w,h
+        image_input = self.transform_frames(resize_frames(frames, (target_size[1], target_size[0]), antialias))
+        cut_shape = [(image_input.shape[2]//self.image_size[0], image_input.shape[3]//self.image_size[1])] # cut_h, cut_w
+        new_images = rearrange(image_input, 'T C (num_h h) (num_w w) -> T (num_h num_w) C h w', h=self.image_size[0], w=self.image_size[1])
+
+        if self.add_global:
+            global_images = self.transform_frames(resize_frames(frames, self.image_size, antialias))
+            new_images = torch.cat([new_images, global_images.unsqueeze(1)], dim=1)
+            cut_shape.append((1,1))
+
+        cut_shape_indices = build_cut_shape_indices(cut_shape)
+        return new_images.flatten(0, 1), cut_shape * num_frames, cut_shape_indices.repeat(num_frames, 1)
+
 class mPLUGOwl3BatchFeature(BatchFeature):
     r"""
     Extend from BatchFeature for supporting various image size
@@ -394,6 +448,8 @@ class mPLUGOwl3ImageProcessor(BaseImageProcessor, CutMixin):
             **kwargs):
         super().__init__(**kwargs)
         self.image_size = image_size
+        self.image_mean = mean
+        self.image_std = std
         self.image_transform = transforms.Compose([
             transforms.Resize((image_size, image_size), interpolation=Image.BICUBIC),
             # transforms.ToTensor(),
@@ -402,6 +458,15 @@ class mPLUGOwl3ImageProcessor(BaseImageProcessor, CutMixin):
         ])
         CutMixin.__init__(self)
 
+    def transform_frames(self, frames):
+        """
+        Batched `image_transform` of resized frames of shape (T, C, H, W), fusing the rescaling and normalization into a single
+        multiply-add.
+        """
+        std = torch.tensor(self.image_std, device=frames.device).view(-1, 1, 1)
+        mean = torch.tensor(self.image_mean, device=frames.device).view(-1, 1, 1)
+        return frames.float().mul_(1 / (255 * std)).add_(-mean / std)
+
     def preprocess(
             self, 
             images: Union[Image.Image, List[Image.Image]],
@@ -416,8 +481,12 @@ class mPLUGOwl3ImageProcessor(BaseImageProcessor, CutMixin):
         if self.cut_enable and cut_enable:
             image_data, cut_shape, cut_shape_indices = self._process_image(images_list)
         else:
-            image_data = [self.image_transform(self.resizer.resize_global(image)) for image in images_list]
-            image_data = torch.stack(image_data, dim=0)
+            frames = stack_frames(images_list)
+            if frames is not None:
+                image_data = self.transform_frames(resize_frames(frames, self.image_size, bool(self.resizer.antialias)))
+            else:
+                image_data = [self.image_transform(self.resizer.resize_global(image)) for image in images_list]
+                image_data = torch.stack(image_data, dim=0)
             cut_shape = cut_shape_indices = None
             
         return mPLUGOwl3BatchFeature(data={'pixel_values': image_data, 'cut_shape':cut_shape, 'cut_shape_indices':cut_shape_indices})
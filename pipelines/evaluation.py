@@ -1,23 +1,23 @@
 import string
 import random
 from collections import OrderedDict
-from tqdm import tqdm
 import numpy as np
 
-from dataset import VidHalDataset
+from dataset import VidHalDataset, VidHalAnnotationIndex
 from utils import generate_display_order
 
 class EvaluationPipeline:
     def __init__(
         self, 
         predictions : dict, # dict of video_id -> predicted responses
-        dataset : VidHalDataset, 
+        dataset : VidHalDataset, # Or VidHalAnnotationIndex
         option_display_order : dict = None, # Optional argument specifying the pre-defined randomization seed for input caption display order
         *args, **kwargs
     ):
         self.predictions = predictions
-        self.dataset = dataset
-        self.option_display_order = option_display_order if option_display_order is not None else generate_display_order(dataset)
+        # Only annotations are required for evaluation, avoid loading videos
+        self.dataset = VidHalAnnotationIndex.from_dataset(dataset)
+        self.option_display_order = option_display_order if option_display_order is not None else generate_display_order(self.dataset)
 
     def evaluate(self):
         raise NotImplementedError
@@ -28,15 +28,14 @@ class VidHalMCQAEvaluationPipeline(EvaluationPipeline):
 
     def evaluate(self):
         accuracy, total = {"overall" : 0}, {"overall" : 0}
-        for i in tqdm(range(len(self.dataset))):
-            example = self.dataset[i]
-            video_id, captions, aspect = example["video_id"], example["captions"], example["aspect"]
+        for video_id, captions, aspect, option_to_rank in zip(
+            self.dataset.video_ids, self.dataset.captions, self.dataset.aspects, self.dataset.option_orders(self.option_display_order)
+        ):
             if aspect not in accuracy: 
                 accuracy[aspect] = 0
             if aspect not in total:
                 total[aspect] = 0
             
-            option_to_rank = self.option_display_order[video_id]
             answer = {v : k for k, v in option_to_rank.items()}["1"]
             prediction, answer_phrase = self.predictions[video_id], captions["1"]
             is_correct = (
@@ -109,15 +108,14 @@ class VidHalCaptionOrderingEvaluationPipeline(EvaluationPipeline):
     
     def evaluate(self):
         ndcg, total, order_prediction_frequency = {"overall" : 0}, {"overall" : 0}, {}
-        for i in tqdm(range(len(self.dataset))):
-            example = self.dataset[i]
-            video_id, aspect = example["video_id"], example["aspect"]
+        for video_id, aspect, option_to_rank in zip(
+            self.dataset.video_ids, self.dataset.aspects, self.dataset.option_orders(self.option_display_order)
+        ):
             if aspect not in ndcg: 
                 ndcg[aspect] = 0
             if aspect not in total:
                 total[aspect] = 0
 
-            option_to_rank = self.option_display_order[video_id]
             # Predictions expected to be either in comma separated string form (e.g 'A, B, C') or list form (e.g. ['A', 'B', 'C'])
             prediction = self.predictions[video_id]
             # if len(prediction) == 0:
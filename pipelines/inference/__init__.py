@@ -1,4 +1,4 @@
-from pipelines.inference.base import VidHalInferencePipeline
+from pipelines.inference.base import VidHalInferencePipeline, run_tasks
 from pipelines.inference.random import *
 from pipelines.inference.gpt4 import *
 from pipelines.inference.gemini import *
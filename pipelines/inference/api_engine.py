@@ -0,0 +1,174 @@
+"""
+Concurrent request engine for the API-based pipelines (e.g. GPT-4o, Gemini, Together AI), overlapping the network latency of
+several requests instead of issuing one blocking call per example.
+"""
+import os
+import time
+import random
+import asyncio
+from functools import partial
+
+from dataset import VidHalDataset, VidHalAnnotationIndex
+from cache import EncodedFrameStore, encode_frames
+from pipelines.inference.base import VidHalInferencePipeline
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = ["RateLimit", "Timeout", "Connection", "ResourceExhausted", "ServiceUnavailable", "InternalServer"]
+
+def is_retryable_error(error):
+    """
+    Whether the error is transient (e.g. rate limits, timeouts and server errors), based on the HTTP status code if available,
+    otherwise on the name of the exception, so that the errors of different client libraries are handled alike.
+    """
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status_code, int) and status_code in RETRYABLE_STATUS_CODES:
+        return True
+
+    return any(name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Requests reserve a token upon arrival and wait until the reserved token is refilled,
+    such that requests are spaced at `rate` per second after an initial burst of up to `capacity` requests.
+    """
+    def __init__(self, rate, capacity=1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        # No await before the reservation, hence atomic within the event loop
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+class AsyncRequestEngine:
+    """
+    Runs blocking API requests concurrently in a thread pool with:
+    1. At most `max_concurrency` requests in flight.
+    2. Token bucket rate limiting of `requests_per_minute`, shared by all engines of the same model.
+    3. Retries of transient errors with exponential backoff and full jitter, up to `max_retries` times.
+
+    Responses are returned in the order of the requests, regardless of the order of completion.
+    """
+    rate_limiters = {} # Model -> TokenBucket
+    def __init__(
+        self, model,
+        max_concurrency=8,
+        requests_per_minute=None, # No rate limiting if None
+        max_retries=5,
+        base_delay=1.0, max_delay=60.0, # Backoff delay (in seconds) of the first retry, and the maximum backoff delay
+        is_retryable=is_retryable_error,
+        fallback_response=None # Returned if all retries fail, otherwise the last error is raised
+    ) -> None:
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_retryable = is_retryable
+        self.fallback_response = fallback_response
+        if requests_per_minute is not None and model not in self.rate_limiters:
+            self.rate_limiters[model] = TokenBucket(requests_per_minute / 60)
+        self.rate_limiter = self.rate_limiters.get(model) if requests_per_minute is not None else None
+
+    def get_backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def request(self, request_fn, semaphore):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                try:
+                    return await asyncio.to_thread(request_fn)
+                except Exception as e:
+                    if not self.is_retryable(e) or attempt == self.max_retries:
+                        if self.fallback_response is None:
+                            raise
+                        print(f"Request failed after {attempt + 1} attempts: {e!r}, recording fallback response {self.fallback_response!r}")
+                        return self.fallback_response
+                    delay = self.get_backoff_delay(attempt)
+                    print(f"Got error: {e}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                    await asyncio.sleep(delay)
+
+    async def run_async(self, request_fns):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*[self.request(request_fn, semaphore) for request_fn in request_fns])
+
+    def run(self, request_fns):
+        """
+        Args:
+            request_fns (list) : Functions each taking no arguments and returning the response to a single request
+        Returns:
+            responses (list) : Responses in the same order as `request_fns`
+        """
+        return list(asyncio.run(self.run_async(request_fns)))
+
+class VidHalAPIInferencePipeline(VidHalInferencePipeline):
+    """
+    Base pipeline for API-based models, which only need to implement `request_response` as a single blocking request.
+    Batches of examples (see `--batch_size`) are requested concurrently through `AsyncRequestEngine`.
+    """
+    fallback_response = None # Response used if all retries of a request fail, otherwise the error is raised
+    frame_sampling = None # Sampling policy of frames sent to the model (see `cache.encode_frames`), None if videos are not sent as frames
+    def __init__(
+        self, model, dataset : VidHalDataset, num_captions=3, option_display_order = None, generation_config = {}, *args,
+        max_concurrency = 8, # Maximum number of requests in flight
+        requests_per_minute = None, # Rate limit shared by all pipelines of the same model, None for no limit
+        max_retries = 5, # Retries of rate limit, timeout and server errors with exponential backoff
+        frame_store_dir = None, # Directory of pre-encoded frames, built for all videos in the dataset if provided
+        frame_store_workers = 8,
+        jpeg_quality = 95,
+        max_frame_side = None, # Frames are downscaled such that the longer side is at most this size if provided
+        **kwargs
+    ):
+        super().__init__(model, dataset, num_captions, option_display_order, generation_config, *args, **kwargs)
+
+        self.frame_encoding = {**(self.frame_sampling or {}), "quality" : jpeg_quality, "max_side" : max_frame_side}
+        self.frame_store = EncodedFrameStore(frame_store_dir) if frame_store_dir is not None else None
+        if self.frame_store is not None and self.frame_sampling is not None:
+            video_ids = VidHalAnnotationIndex.from_dataset(dataset).video_ids
+            self.frame_store.build(
+                [os.path.join(dataset.video_root, f"{video_id}.mp4") for video_id in video_ids],
+                num_workers=frame_store_workers, **self.frame_encoding
+            )
+
+        self.engine = AsyncRequestEngine(
+            model, max_concurrency=max_concurrency, requests_per_minute=requests_per_minute, max_retries=max_retries,
+            is_retryable=self.is_retryable, fallback_response=self.fallback_response
+        )
+
+    def is_retryable(self, error):
+        return is_retryable_error(error)
+
+    def encode_frames(self, video_path):
+        """
+        Returns the base64-encoded JPEG frames of the video, read from the frame store if provided, and re-used across prompts on the same video
+        """
+        encode_fn = self.frame_store.encode_frames if self.frame_store is not None else encode_frames
+        return self.get_visual_features(video_path, partial(encode_fn, video_path, **self.frame_encoding), key="frames")
+
+    def request_response(self, main_prompt, system_prompt=None, image_path=None):
+        """
+        NOTE: Implement this to request the response to a single prompt from the API, raising errors to be retried by the engine
+        """
+        raise NotImplementedError
+
+    def generate_response(self, video, main_prompt, system_prompt=None, image_path=None, *args, **kwargs):
+        return self.engine.run([lambda: self.request_response(main_prompt, system_prompt=system_prompt, image_path=image_path)])[0]
+
+    def generate_response_batch(self, videos, main_prompts, system_prompts=None, generation_config={}, image_paths=None, *args, **kwargs):
+        if system_prompts is None:
+            system_prompts = [None] * len(main_prompts)
+        if image_paths is None:
+            image_paths = [None] * len(main_prompts)
+
+        return self.engine.run([
+            partial(self.request_response, main_prompt, system_prompt=system_prompt, image_path=image_path)
+            for main_prompt, system_prompt, image_path in zip(main_prompts, system_prompts, image_paths)
+        ])
@@ -1,11 +1,15 @@
 import string
 import re
-import json
+import math
+import threading
 import torch
+from torch.utils.data import DataLoader, Subset
 from tqdm import tqdm
 
-from dataset import VidHalDataset
+from dataset import VidHalDataset, VidHalAnnotationIndex
 from utils import generate_display_order
+from pipelines.inference.prefix_cache import forward_from_prefix
+from pipelines.inference.checkpoint import PredictionCheckpoint
 
 class VidHalInferencePipeline:
     """
@@ -15,6 +19,9 @@ class VidHalInferencePipeline:
     """
     system_prompt_instruction = ""
     main_prompt_instruction = ""
+    use_cache_position = False # Whether the model requires explicit cache positions when continuing from a KV cache
+    supports_batching = True # Whether `predict` is run on batches of `batch_size` examples, otherwise one example at a time
+    visual_features_lock = threading.RLock() # Guards the memo of `get_visual_features`, shared across pipelines and request threads
     def __init__(
         self, 
         model,
@@ -22,12 +29,30 @@ class VidHalInferencePipeline:
         num_captions = 3,
         option_display_order : dict = None,
         generation_config = {},
-        *args, **kwargs
+        *args, 
+        num_workers = 0, # Number of worker processes for loading and pre-processing videos in the background
+        prefetch_factor = 2, # Number of examples pre-loaded by each worker
+        pin_memory = False,
+        batch_size = 1, # Number of videos to generate responses for at once, relative ordering is always run per video
+        cache_visual_features = True, # Reuse visual features across prompts on the same video, for pipelines that support it
+        use_prefix_cache = False, # Prefill the prompt prefix shared by questions on the same video once, for pipelines that support it
+        scoring = False, # Select options from the next-token logits of the option letters instead of parsing generated responses
+        fsync_interval = 1, # Number of responses between each fsync of the prediction checkpoint, 0 leaves flushing to the OS
+        **kwargs
     ):
         self.model = model
         self.dataset = dataset
         self.generation_config = generation_config
         self.num_captions = num_captions
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.pin_memory = pin_memory
+        self.batch_size = batch_size
+        self.cache_visual_features = cache_visual_features
+        self.visual_features = {}
+        self.use_prefix_cache = use_prefix_cache
+        self.scoring = scoring
+        self.fsync_interval = fsync_interval
         if option_display_order is None:
             print("No pre-defined option randomization supplied, generating one...")
             option_display_order = generate_display_order(dataset)
@@ -72,36 +97,166 @@ class VidHalInferencePipeline:
         """
         raise NotImplementedError
 
+    def generate_response_batch(
+        self,
+        videos,
+        main_prompts, system_prompts=None,
+        generation_config={},
+        *args, **kwargs):
+        """
+        Batched counterpart of `generate_response`, where each argument is a list with one entry per sample.
+        Override this with batched generation (e.g. left-padded prompts) if supported by your model,
+        otherwise responses are generated one sample at a time.
+
+        Expected return type:
+            responses (list) : Responses generated by the model, in the same order as the inputs.
+        """
+        if system_prompts is None:
+            system_prompts = [None] * len(videos)
+        image_paths = kwargs.pop("image_paths", [None] * len(videos))
+
+        return [
+            self.generate_response(
+                video=video, main_prompt=main_prompt, system_prompt=system_prompt,
+                generation_config=generation_config, image_path=image_path,
+                *args, **kwargs
+            ) for video, main_prompt, system_prompt, image_path in zip(videos, main_prompts, system_prompts, image_paths)
+        ]
+
+    def get_visual_features(self, video_path, encode_fn, key=None):
+        """
+        Returns the visual features of the video at `video_path` computed by `encode_fn`, encoding the video only on first use.
+        Features are memoised for the most recently encoded video only, and should be retrieved through this function by
+        pipelines that support re-using them when prompting multiple questions on the same video (e.g. relative ordering).
+        `key` distinguishes features of the same video computed with different settings (e.g. prefilled prompt prefixes).
+        """
+        if not self.cache_visual_features or video_path is None:
+            return encode_fn()
+
+        with self.visual_features_lock:
+            features = self.visual_features.get((video_path, key))
+            if features is None:
+                features = encode_fn()
+                # Cleared in-place, as the memo may be shared across pipelines (see `run_tasks`) and threads (see `VidHalAPIInferencePipeline`)
+                if any(x != video_path for x, _ in self.visual_features):
+                    self.visual_features.clear()
+                self.visual_features[(video_path, key)] = features
+
+        return features
+
+    def prefill_prompt(
+        self,
+        video,
+        main_prompt, system_prompt=None,
+        *args, **kwargs):
+        """
+        NOTE: Implement this according to your model requirements to support scoring of options via logits
+
+        Expected return type:
+            outputs (tuple) : Consisting of (next_token_logits, past_key_values) after a single forward pass over the full prompt
+        """
+        raise NotImplementedError
+
+    def get_option_token_ids(self, option):
+        """
+        Returns the token IDs the model may use to start a response with the given option letter, with or without a preceding space
+        """
+        tokenizer = self.text_processor.tokenizer
+        return list(set([
+            tokenizer.encode(option, add_special_tokens=False)[-1], tokenizer.encode(f" {option}", add_special_tokens=False)[-1]
+        ]))
+
+    def get_option_scores(self, logits, options):
+        """
+        Returns the highest next-token logit over the token IDs of each option, along with the corresponding token IDs
+        """
+        scores, token_ids = [], []
+        for option in options:
+            option_token_ids = self.get_option_token_ids(option)
+            option_logits = logits[0, option_token_ids]
+            scores.append(option_logits.max().item())
+            token_ids.append(option_token_ids[option_logits.argmax().item()])
+
+        return scores, token_ids
+
+    def score_response(
+        self,
+        video,
+        main_prompt, system_prompt=None,
+        *args, **kwargs):
+        """
+        Counterpart of `generate_response` for scoring mode, selecting the response from the option logits of the model.
+
+        Expected return type:
+            response (str) : Response in the same format as generated by the model
+        """
+        raise NotImplementedError
+
     def process_response(self, response):
         return response
-    
-    def run(self, save_path=None):
-        responses = {}
-        with torch.inference_mode(), torch.no_grad():
-            for i in tqdm(range(len(self.dataset))):
-                example = self.dataset[i]
-                video, video_id, captions, video_path = example["video"], example["video_id"], example["captions"], example["video_path"]
-
-                # Format caption options to be displayed to the model
-                options_prompt = self.format_options_prompt(captions=captions, video_id=video_id)
-                main_prompt, system_prompt = self.format_prompt(
-                    self.main_prompt_instruction, options_prompt, self.system_prompt_instruction
-                )
 
-                # Generate response from the model
-                response = self.generate_response(
-                   video=video, main_prompt=main_prompt, system_prompt=system_prompt, 
-                   generation_config=self.generation_config,
-                   # For proprietary models
-                   image_path=video_path
-                )
-                response = self.process_response(response)
+    def get_dataloader(self, batch_size=None, indices=None):
+        """
+        Iterates over the dataset one example at a time (or lists of `batch_size` examples if provided), overlapping video decoding 
+        and pre-processing of upcoming examples with generation on the current example when `num_workers` > 0.
+        Only the examples at `indices` are loaded if provided.
+        NOTE: Visual processors that place tensors on the GPU must be run with `num_workers` = 0
+        """
+        return DataLoader(
+            Subset(self.dataset, indices) if indices is not None else self.dataset, batch_size=batch_size, shuffle=False,
+            collate_fn=list if batch_size is not None else None,
+            num_workers=self.num_workers,
+            prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
+            pin_memory=self.pin_memory
+        )
+    
+    def predict(self, examples):
+        """
+        Generates the processed responses to a list of examples from the dataloader, returned as a dictionary of video ID -> response
+        """
+        videos, video_ids, video_paths = [x["video"] for x in examples], [x["video_id"] for x in examples], [x["video_path"] for x in examples]
+
+        # Format caption options to be displayed to the model
+        main_prompts, system_prompts, options_prompts = [], [], []
+        for example in examples:
+            options_prompt = self.format_options_prompt(captions=example["captions"], video_id=example["video_id"])
+            main_prompt, system_prompt = self.format_prompt(
+                self.main_prompt_instruction, options_prompt, self.system_prompt_instruction
+            )
+            main_prompts.append(main_prompt)
+            system_prompts.append(system_prompt)
+            options_prompts.append(options_prompt)
+
+        # Generate response from the model
+        if self.scoring:
+            batch_responses = [self.score_response(
+                video=video, main_prompt=main_prompt, system_prompt=system_prompt, image_path=video_path
+            ) for video, main_prompt, system_prompt, video_path in zip(videos, main_prompts, system_prompts, video_paths)]
+        elif len(examples) > 1:
+            batch_responses = self.generate_response_batch(
+                videos=videos, main_prompts=main_prompts, system_prompts=system_prompts,
+                generation_config=self.generation_config,
+                # For proprietary models
+                image_paths=video_paths
+            )
+        else:
+            batch_responses = [self.generate_response(
+                video=videos[0], main_prompt=main_prompts[0], system_prompt=system_prompts[0], 
+                generation_config=self.generation_config,
+                # For proprietary models
+                image_path=video_paths[0],
+                # For prompt prefix caching
+                options_prompt=options_prompts[0]
+            )]
 
-                responses[video_id] = response
+        return {video_id : self.process_response(response) for video_id, response in zip(video_ids, batch_responses)}
 
-        if save_path is not None:
-            with open(save_path, "w") as f:
-                json.dump(responses, f, indent=4)
+    def run(self, save_path=None):
+        """
+        Generates responses for all examples in the dataset. If `save_path` is provided, responses are checkpointed as they are
+        generated, and examples already answered in the checkpoint of an interrupted run are skipped.
+        """
+        run_tasks({None : self}, save_paths={None : save_path} if save_path is not None else None)
 
 class VidHalMCQAInferencePipeline(VidHalInferencePipeline):
     system_prompt_instruction = "You are provided with a video and a set of several captions. " \
@@ -119,7 +274,19 @@ class VidHalMCQAInferencePipeline(VidHalInferencePipeline):
 
         return match if match else response # If no match, keep original response in case model replies with caption instead of option
 
+    @torch.no_grad()
+    def score_response(self, video, main_prompt, system_prompt=None, num_options=None, *args, **kwargs):
+        """
+        Selects the option with the highest next-token logit after the prompt, from a single forward pass
+        """
+        options = list(string.ascii_uppercase)[:num_options if num_options is not None else self.num_captions]
+        logits, _ = self.prefill_prompt(video=video, main_prompt=main_prompt, system_prompt=system_prompt, *args, **kwargs)
+        scores, _ = self.get_option_scores(logits, options)
+
+        return options[max(range(len(options)), key=lambda i: scores[i])]
+
 class VidHalRelativeOrderingInferencePipeline(VidHalMCQAInferencePipeline):
+    supports_batching = False
     def reorder_options(self, captions, option_to_rank):
         """
         Re-orders the option prefixes (A, B, C) if there are less then the total number of captions presented to the model
@@ -149,10 +316,15 @@ class VidHalRelativeOrderingInferencePipeline(VidHalMCQAInferencePipeline):
         main_prompt, system_prompt = self.format_prompt(
             self.main_prompt_instruction, options_prompt, self.system_prompt_instruction
         )
-        response = self.generate_response(
-            video=video, main_prompt=main_prompt, system_prompt=system_prompt, generation_config=self.generation_config,
-            image_path=video_path
-        )
+        if self.scoring:
+            response = self.score_response(
+                video=video, main_prompt=main_prompt, system_prompt=system_prompt, num_options=len(options), image_path=video_path
+            )
+        else:
+            response = self.generate_response(
+                video=video, main_prompt=main_prompt, system_prompt=system_prompt, generation_config=self.generation_config,
+                image_path=video_path, options_prompt=options_prompt
+            )
 
         # Process response and map back to original
         try:
@@ -217,18 +389,13 @@ class VidHalRelativeOrderingInferencePipeline(VidHalMCQAInferencePipeline):
 
         return overall_order
 
-    def run(self, save_path=None):
-        responses = {}
-        with torch.inference_mode(), torch.no_grad():
-            for i in tqdm(range(len(self.dataset))):
-                example = self.dataset[i]
-                video, video_id, captions, video_path = example["video"], example["video_id"], example["captions"], example["video_path"]
-                predicted_order = self.prompt_relative_ordering(video, video_id, captions, video_path=video_path)
-                responses[video_id] = predicted_order
-
-        if save_path is not None:
-            with open(save_path, "w") as f:
-                json.dump(responses, f, indent=4)
+    def predict(self, examples):
+        return {
+            example["video_id"] : self.prompt_relative_ordering(
+                example["video"], example["video_id"], example["captions"], video_path=example["video_path"]
+            ) for example in examples
+        }
+
 
 class VidHalNaiveOrderingInferencePipeline(VidHalInferencePipeline):
     system_prompt_instruction = "You are provided with a video and a set of several captions. " \
@@ -256,6 +423,34 @@ class VidHalNaiveOrderingInferencePipeline(VidHalInferencePipeline):
             main_prompt = f"{main_prompt}\n{self.main_prompt_hint}"
         return super().format_prompt(main_prompt, options_prompt, system_prompt, *args, **kwargs)
 
+    @torch.no_grad()
+    def score_response(self, video, main_prompt, system_prompt=None, *args, **kwargs):
+        """
+        Greedily decodes a permutation of the options, restricting each step to the option letters not yet ranked
+        """
+        tokenizer = self.text_processor.tokenizer
+        remaining_options = list(string.ascii_uppercase)[:self.num_captions]
+        logits, past_key_values = self.prefill_prompt(video=video, main_prompt=main_prompt, system_prompt=system_prompt, *args, **kwargs)
+
+        order = []
+        while len(remaining_options) > 1:
+            scores, token_ids = self.get_option_scores(logits, remaining_options)
+            index = max(range(len(remaining_options)), key=lambda i: scores[i])
+            option, token_id = remaining_options.pop(index), token_ids[index]
+            order.append(option)
+            if len(remaining_options) == 1:
+                break
+
+            # Continue with the selected option and separator (e.g. "B,") to score the next position
+            option_ids = tokenizer.encode(option, add_special_tokens=False)
+            separator_ids = tokenizer.encode(f"{option},", add_special_tokens=False)
+            separator_ids = separator_ids[len(option_ids):] if separator_ids[:len(option_ids)] == option_ids else tokenizer.encode(",", add_special_tokens=False)
+            input_ids = torch.tensor([[token_id] + separator_ids], device=logits.device)
+            logits, past_key_values = forward_from_prefix(self.model, past_key_values, input_ids, use_cache_position=self.use_cache_position)
+        order.extend(remaining_options)
+
+        return ", ".join(order)
+
     def process_response(self, response):
         def condense_sequence(sequence):
             """
@@ -322,3 +517,37 @@ class VidHalNaiveOrderingInferencePipeline(VidHalInferencePipeline):
             return initial_match
         
         return matches
+
+def run_tasks(pipelines : dict, save_paths : dict = None):
+    """
+    Runs the pipelines of several tasks sharing the same model and dataset in a single pass over the dataset, such that each video
+    is only loaded once, and visual features cached by `get_visual_features` are re-used across tasks.
+    Responses of each task are checkpointed to resume from if interrupted, such that only unanswered examples are run on restart.
+
+    Args:
+        pipelines (dict) : Task -> VidHalInferencePipeline
+        save_paths (dict) : Task -> Path to save the responses of the task to
+    """
+    pipeline = next(iter(pipelines.values()))
+    batch_size = pipeline.batch_size if all(x.supports_batching for x in pipelines.values()) else 1
+    # Share cached visual features across tasks
+    visual_features = {}
+    for task_pipeline in pipelines.values():
+        task_pipeline.visual_features = visual_features
+
+    checkpoints = {
+        task : PredictionCheckpoint(save_path, fsync_interval=pipelines[task].fsync_interval) for task, save_path in save_paths.items()
+    } if save_paths is not None else {}
+    video_ids = VidHalAnnotationIndex.from_dataset(pipeline.dataset).video_ids
+    indices = [i for i, video_id in enumerate(video_ids) if not all(video_id in checkpoint for checkpoint in checkpoints.values())]
+    with torch.inference_mode(), torch.no_grad():
+        for examples in tqdm(pipeline.get_dataloader(batch_size=batch_size, indices=indices), total=math.ceil(len(indices) / batch_size)):
+            for task, task_pipeline in pipelines.items():
+                if task in checkpoints:
+                    pending_examples = [example for example in examples if example["video_id"] not in checkpoints[task]]
+                    if len(pending_examples):
+                        checkpoints[task].update(task_pipeline.predict(pending_examples))
+                else:
+                    task_pipeline.predict(examples)
+
+    return {task : checkpoint.finalize(video_ids) for task, checkpoint in checkpoints.items()}
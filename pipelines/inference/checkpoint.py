@@ -0,0 +1,72 @@
+"""
+Append-only checkpointing of predictions, so that interrupted inference runs (e.g. crashes or API quota errors) can be resumed
+without regenerating responses for videos that were already answered.
+"""
+import os
+import json
+
+class PredictionCheckpoint:
+    """
+    Streams each response as a JSON line {"video_id" : ..., "response" : ...} to `<save_path>.partial.jsonl` as soon as it is generated.
+    On restart, responses already in the checkpoint are loaded and skipped. Once the run completes, `finalize` compacts
+    the responses into `save_path` in the usual JSON format and removes the checkpoint.
+    """
+    def __init__(self, save_path, fsync_interval=1) -> None:
+        self.save_path = save_path
+        self.checkpoint_path = f"{save_path}.partial.jsonl"
+        self.fsync_interval = fsync_interval # Number of responses between each fsync, 0 leaves flushing to disk to the OS
+        self.responses = self.load()
+        self.num_unsynced = 0
+        self.file = open(self.checkpoint_path, "a")
+
+    def load(self):
+        responses = {}
+        if not os.path.isfile(self.checkpoint_path):
+            return responses
+
+        with open(self.checkpoint_path, "r") as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError: # Partially written record from an interrupted run
+                continue
+            responses[record["video_id"]] = record["response"]
+        if len(responses):
+            print(f"Resuming from {len(responses)} responses in {self.checkpoint_path}")
+        # Rewrite only complete records, so that new records are not appended onto a partially written line
+        with open(self.checkpoint_path, "w") as f:
+            for video_id, response in responses.items():
+                f.write(json.dumps({"video_id" : video_id, "response" : response}) + "\n")
+
+        return responses
+
+    def __contains__(self, video_id):
+        return video_id in self.responses
+
+    def update(self, responses):
+        for video_id, response in responses.items():
+            self.file.write(json.dumps({"video_id" : video_id, "response" : response}) + "\n")
+            self.responses[video_id] = response
+        self.file.flush()
+
+        self.num_unsynced += len(responses)
+        if self.fsync_interval > 0 and self.num_unsynced >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.num_unsynced = 0
+
+    def finalize(self, video_ids=None):
+        """
+        Writes all responses to `save_path`, ordered by `video_ids` if provided, and removes the checkpoint
+        """
+        self.file.close()
+        responses = self.responses
+        if video_ids is not None:
+            responses = {video_id : responses[video_id] for video_id in video_ids if video_id in responses}
+
+        with open(f"{self.save_path}.tmp", "w") as f:
+            json.dump(responses, f, indent=4)
+        os.replace(f"{self.save_path}.tmp", self.save_path)
+        os.remove(self.checkpoint_path)
+
+        return responses
@@ -1,19 +1,140 @@
 import os
 import time
-import google.api_core.exceptions
+import json
+import hashlib
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from tqdm import tqdm
 
-from dataset import VidHalDataset
+from dataset import VidHalDataset, VidHalAnnotationIndex
 from pipelines.inference.base import (
-    VidHalInferencePipeline,
     VidHalMCQAInferencePipeline,
     VidHalNaiveOrderingInferencePipeline,
     VidHalRelativeOrderingInferencePipeline
 )
+from pipelines.inference.api_engine import VidHalAPIInferencePipeline, is_retryable_error
 
-class GeminiInferencePipeline(VidHalInferencePipeline):
-    def __init__(self, model, api_key, dataset : VidHalDataset, num_captions=3, option_display_order = None, generation_config=..., *args, **kwargs):
+class GeminiUploadError(RuntimeError):
+    """
+    Raised when an uploaded video fails to be processed by the Gemini File API, upon which the video is uploaded again
+    """
+
+class GeminiFileRegistry:
+    """
+    Local registry of videos uploaded to the Gemini File API, keyed by video name and content hash, and optionally persisted
+    to `registry_path` across runs. Requests refer to uploaded videos by their URI in the registry, without any further network
+    round-trip. Entries are re-uploaded once expired (uploaded files are deleted after 48 hours). A single registry is shared by
+    the pipelines of all tasks, such that videos are only hashed and looked up once per run.
+    """
+    def __init__(self, registry_path=None, poll_interval=2.0, max_poll_interval=30.0) -> None:
+        self.registry_path = registry_path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.entries = {}
+        if registry_path is not None and os.path.isfile(registry_path):
+            with open(registry_path, "r") as f:
+                self.entries = json.load(f)
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, video_path):
+        # Content hashes are memoized by path, modification time and size
+        stat = os.stat(video_path)
+        if (video_path, stat.st_mtime_ns, stat.st_size) not in self.hashes:
+            content_hash = hashlib.sha1()
+            with open(video_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    content_hash.update(chunk)
+            self.hashes[(video_path, stat.st_mtime_ns, stat.st_size)] = content_hash.hexdigest()
+        video_name = os.path.splitext(os.path.basename(video_path))[0].replace("_", "-").lower()
+
+        return f"{video_name}-{self.hashes[(video_path, stat.st_mtime_ns, stat.st_size)][:8]}"
+
+    def is_valid(self, entry):
+        if entry is None:
+            return False
+        if entry.get("expiration_time") is None:
+            return True
+        # Leave a margin for requests in flight
+        expiration_time = datetime.datetime.fromisoformat(entry["expiration_time"])
+        return expiration_time - datetime.timedelta(hours=1) > datetime.datetime.now(datetime.timezone.utc)
+
+    def wait_until_processed(self, video_file):
+        """
+        Polls the state of the uploaded file with exponential backoff until it is processed
+        """
+        poll_interval = self.poll_interval
+        while video_file.state.name == "PROCESSING":
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, self.max_poll_interval)
+            video_file = genai.get_file(video_file.name)
+
+        return video_file
+
+    def upload(self, video_path):
+        key = self.get_key(video_path)
+        try:
+            # File names are unique, hence an existing file with the same key has the same contents
+            video_file = genai.get_file(key)
+        except Exception:
+            video_file = None
+        if video_file is not None:
+            video_file = self.wait_until_processed(video_file)
+        if video_file is not None and video_file.state.name != "ACTIVE":
+            # Files that failed processing are never re-processed, and their name must be freed before uploading again
+            genai.delete_file(video_file.name)
+            video_file = None
+        if video_file is None:
+            video_file = self.wait_until_processed(genai.upload_file(path=video_path, name=key))
+        if video_file.state.name != "ACTIVE":
+            raise GeminiUploadError(f"Processing of uploaded video {video_file.name} failed with state {video_file.state.name}")
+
+        entry = {
+            "name" : video_file.name, "uri" : video_file.uri, "mime_type" : video_file.mime_type,
+            "expiration_time" : video_file.expiration_time.isoformat() if video_file.expiration_time else None
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.save()
+
+        return entry
+
+    def save(self):
+        if self.registry_path is None:
+            return
+        with open(f"{self.registry_path}.tmp", "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(f"{self.registry_path}.tmp", self.registry_path)
+
+    def get(self, video_path):
+        """
+        Returns the registry entry of the video, uploading it first if not uploaded yet
+        """
+        entry = self.entries.get(self.get_key(video_path))
+        return entry if self.is_valid(entry) else self.upload(video_path)
+
+    def upload_all(self, video_paths, num_workers=8):
+        """
+        Uploads all videos not in the registry concurrently, waiting until all are processed
+        """
+        video_paths = [x for x in video_paths if not self.is_valid(self.entries.get(self.get_key(x)))]
+        if len(video_paths) < 1:
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for _ in tqdm(executor.map(self.upload, video_paths), total=len(video_paths), desc="Uploading videos"):
+                pass
+
+class GeminiInferencePipeline(VidHalAPIInferencePipeline):
+    fallback_response = ""
+    def __init__(
+        self, model, api_key, dataset : VidHalDataset, num_captions=3, option_display_order = None, generation_config=..., *args, 
+        upload_registry_path=None, # Registry of uploaded videos persisted across runs
+        upload_registry : GeminiFileRegistry = None, # Registry shared with the pipelines of other tasks, built from `upload_registry_path` if None
+        **kwargs
+    ):
         super().__init__(model, dataset, num_captions, option_display_order, generation_config, *args, **kwargs)
 
         genai.configure(api_key=api_key)
@@ -43,51 +164,28 @@ class GeminiInferencePipeline(VidHalInferencePipeline):
             ]
         )
 
-    def upload_file(self, video_path):
-        video_name = os.path.splitext(os.path.basename(video_path))[0].replace("_", "-")
-        return genai.upload_file(path=video_path, name=video_name)
+        # Upload all videos before inference, skipping those already uploaded for other tasks
+        self.registry = upload_registry if upload_registry is not None else GeminiFileRegistry(upload_registry_path)
+        video_ids = VidHalAnnotationIndex.from_dataset(dataset).video_ids
+        self.registry.upload_all(
+            [os.path.join(dataset.video_root, f"{video_id}.mp4") for video_id in video_ids], num_workers=self.engine.max_concurrency
+        )
 
     def format_prompt(self, main_prompt, options_prompt, system_prompt=None, *args, **kwargs):
         return f"{main_prompt}\n\n{options_prompt}", system_prompt
     
-    def generate_response(self, video, main_prompt, system_prompt=None, image_path=None, *args, **kwargs):        
-        video_name = os.path.splitext(os.path.basename(image_path))[0].replace("_", "-")
-        try:
-            video_file = genai.get_file(f"{video_name}")
-            print(f"Using cached video file: {video_file.name}, state: {video_file.state.name}")
-        except Exception as e:
-            video_file = self.upload_file(image_path)
-
-        max_retries, retry_count = kwargs.get('max_retries', 5), 0
-
-        while retry_count < max_retries:
-            try:
-                # Check if video is still processing
-                if hasattr(video_file, 'state') and video_file.state.name == 'PROCESSING':
-                    time.sleep(2)
-                    continue
-
-                response = self.client.generate_content([
-                    system_prompt, video_file, main_prompt]
-                )
-
-                return response.text
-                
-            except google.api_core.exceptions.ResourceExhausted as e:
-                # Rate limit hit (429 error)
-                print(f"Rate limit hit, waiting 1 minute... (attempt {retry_count + 1})")
-                time.sleep(60)
-                retry_count += 1
-                
-            except Exception as e:
-                print(f"Error generating response: {e}")
-                retry_count += 1
-                if retry_count >= max_retries:
-                    break
-                time.sleep(10)  # Short wait for other errors
-
-        print(f"Max retries ({max_retries}) exceeded")
-        return ""
+    def is_retryable(self, error):
+        # Transient errors, and videos that failed processing (re-uploaded on the next attempt)
+        return is_retryable_error(error) or isinstance(error, GeminiUploadError)
+
+    def request_response(self, main_prompt, system_prompt=None, image_path=None):
+        entry = self.registry.get(image_path)
+        video_file = genai.protos.Part(file_data=genai.protos.FileData(mime_type=entry["mime_type"], file_uri=entry["uri"]))
+        response = self.client.generate_content([
+            system_prompt, video_file, main_prompt]
+        )
+
+        return response.text
 
 class GeminiMCQAInferencePipeline(GeminiInferencePipeline, VidHalMCQAInferencePipeline):
     def __init__(self, model, api_key, dataset, num_captions=3, option_display_order=None, generation_config=..., *args, **kwargs):
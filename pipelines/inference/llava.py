@@ -12,6 +12,7 @@ from models.LLaVA.processors.text_processor import LLaVANeXTTextProcessor, Separ
 from models.LLaVA.processors.visual_processor import LLaVANeXTVideoVisualProcessor
 from models.LLaVA.utils.mm_utils import tokenizer_image_token, KeywordsStoppingCriteria
 from models.LLaVA.llavavid.constants import *
+from pipelines.inference.prefix_cache import split_prefix, prefill, generate_from_prefix
 
 class LLaVANeXTVideoInferencePipeline(VidHalInferencePipeline):
     def __init__(self, 
@@ -58,6 +59,13 @@ class LLaVANeXTVideoInferencePipeline(VidHalInferencePipeline):
         video = [video]
 
         input_ids = tokenizer_image_token(main_prompt, self.text_processor.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).cuda()
+        if self.use_prefix_cache and kwargs.get("options_prompt") and not do_sample and num_beams == 1:
+            response = self.generate_response_with_prefix_cache(
+                video, input_ids, main_prompt, kwargs["options_prompt"], kwargs.get("image_path"), 
+                modalities=modalities, max_new_tokens=max_new_tokens
+            )
+            if response is not None:
+                return response
         if self.text_processor.tokenizer.pad_token_id is None:
             if "qwen" in self.text_processor.tokenizer.name_or_path.lower():
                 print("Setting pad token to bos token for qwen model.")
@@ -96,6 +104,104 @@ class LLaVANeXTVideoInferencePipeline(VidHalInferencePipeline):
         
         return outputs
 
+    def generate_response_with_prefix_cache(self, video, input_ids, main_prompt, options_prompt, video_path, modalities="video", max_new_tokens=1024):
+        """
+        Greedy generation continuing from the cached prefix (system prompt, video and instruction) preceding the options in the prompt.
+        Returns None if the prompt cannot be split into a shared prefix.
+        """
+        tokenizer = self.text_processor.tokenizer
+        suffix_ids = tokenizer(main_prompt[main_prompt.rindex(options_prompt):], add_special_tokens=False, return_tensors="pt").input_ids
+        prefix_ids = split_prefix(input_ids, suffix_ids)
+        if prefix_ids is None:
+            return None
+
+        past_key_values = self.get_visual_features(video_path, lambda: prefill(
+            self.model, inputs_embeds=self.model.prepare_inputs_labels_for_multimodal(
+                prefix_ids.unsqueeze(0), None, None, None, None, video, modalities
+            )[4]
+        ), key=("prefix", tuple(prefix_ids.tolist())))
+
+        stop_str = self.text_processor.sep if self.text_processor.sep_style != SeparatorStyle.TWO else self.text_processor.sep2
+        use_stopping_criteria = self.config is not None and "mistral" not in self.config._name_or_path.lower()
+        output_ids = generate_from_prefix(
+            self.model, past_key_values, suffix_ids.to(input_ids.device), 
+            max_new_tokens=max_new_tokens, eos_token_id=self.model.generation_config.eos_token_id,
+            tokenizer=tokenizer, stop_str=stop_str if use_stopping_criteria else None
+        )
+
+        outputs = tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+        if use_stopping_criteria and outputs.endswith(stop_str):
+            outputs = outputs[: -len(stop_str)]
+
+        return outputs.strip()
+
+    def prefill_prompt(self, video, main_prompt, system_prompt=None, modalities="video", *args, **kwargs):
+        if len(video.shape) > 4:
+            video = video.squeeze(0)
+        input_ids = tokenizer_image_token(main_prompt, self.text_processor.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).cuda()
+        past_key_values, logits = prefill(
+            self.model, return_logits=True, inputs_embeds=self.model.prepare_inputs_labels_for_multimodal(
+                input_ids, None, None, None, None, [video], modalities
+            )[4]
+        )
+
+        return logits, past_key_values
+
+    def generate_response_batch(
+        self, videos, main_prompts, system_prompts=None, modalities="video", 
+        do_sample=False, 
+        temperature=0.0, 
+        max_new_tokens=1024, 
+        top_p=0.1, 
+        num_beams=1, 
+        use_cache=True, 
+        *args, **kwargs
+    ):
+        tokenizer = self.text_processor.tokenizer
+        videos = [video.squeeze(0) if len(video.shape) > 4 else video for video in videos]
+        if tokenizer.pad_token_id is None:
+            if "qwen" in tokenizer.name_or_path.lower():
+                print("Setting pad token to bos token for qwen model.")
+                tokenizer.pad_token_id = 151643
+
+        # Left-pad prompts so that generation continues from the last prompt token of every sample
+        input_ids = [tokenizer_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt") for prompt in main_prompts]
+        max_length = max(len(x) for x in input_ids)
+        attention_masks = torch.stack([
+            torch.cat([torch.zeros(max_length - len(x), dtype=torch.long), torch.ones(len(x), dtype=torch.long)]) for x in input_ids
+        ]).cuda()
+        input_ids = torch.stack([
+            torch.cat([torch.full((max_length - len(x),), tokenizer.pad_token_id, dtype=x.dtype), x]) for x in input_ids
+        ]).cuda()
+        stop_str = self.text_processor.sep if self.text_processor.sep_style != SeparatorStyle.TWO else self.text_processor.sep2
+        use_stopping_criteria = self.config is not None and "mistral" not in self.config._name_or_path.lower()
+
+        # Multimodal embeddings are re-padded by the model according to this setting, restored for later single-sample calls
+        padding_side = getattr(self.model.config, "tokenizer_padding_side", "right")
+        self.model.config.tokenizer_padding_side = "left"
+        try:
+            with torch.no_grad(), torch.inference_mode():
+                output_ids = self.model.generate(
+                    inputs=input_ids, images=videos, attention_mask=attention_masks, 
+                    modalities=[modalities] * len(videos), do_sample=do_sample, 
+                    temperature=temperature, max_new_tokens=max_new_tokens, 
+                    top_p=top_p, num_beams=num_beams, use_cache=use_cache, 
+                    stopping_criteria=[KeywordsStoppingCriteria([stop_str], tokenizer, input_ids)] if use_stopping_criteria else None,
+                    pad_token_id=tokenizer.pad_token_id
+                )
+        finally:
+            self.model.config.tokenizer_padding_side = padding_side
+
+        responses = []
+        for outputs in tokenizer.batch_decode(output_ids, skip_special_tokens=True):
+            outputs = outputs.strip()
+            # Sequences that finished early keep generating until the whole batch stops
+            if use_stopping_criteria and stop_str in outputs:
+                outputs = outputs[: outputs.index(stop_str)]
+            responses.append(outputs.strip())
+
+        return responses
+
 class LLaVANeXTVideoMCQAInferencePipeline(LLaVANeXTVideoInferencePipeline, VidHalMCQAInferencePipeline):
     def __init__(self, dataset, model, vis_processor, text_processor, model_path=None, num_captions=3, option_display_order = None, generation_config=..., *args, **kwargs):
         super().__init__(dataset, model, vis_processor, text_processor, model_path, num_captions, option_display_order, generation_config, *args, **kwargs)
@@ -12,6 +12,7 @@ from models.LongVU.longvu.mm_datautils import tokenizer_image_token,  KeywordsSt
 from models.LongVU.longvu.constants import DEFAULT_IMAGE_TOKEN, IMAGE_TOKEN_INDEX
 from models.LongVU.processors.visual_processor import LongVUVisualProcessor
 from models.LongVU.processors.text_processor import LongVUTextProcessor
+from pipelines.inference.prefix_cache import prefill
 
 class LongVUInferencePipeline(VidHalInferencePipeline):
     def __init__(self, dataset: VidHalDataset, model, vis_processor: LongVUVisualProcessor, text_processor: LongVUTextProcessor, num_captions=3, option_display_order: dict = None, generation_config=None, *args, **kwargs):
@@ -19,12 +20,19 @@ class LongVUInferencePipeline(VidHalInferencePipeline):
 
         self.vis_processor = vis_processor
         self.text_processor = text_processor
+        # LongVU selects the frames of the video (and their resolution) from the length of the whole prompt, such that a prefix
+        # prefilled without the options may keep different frames than the full prompt. The prefix cache is hence not supported.
+        self.use_prefix_cache = False
 
     def format_prompt(self, main_prompt, options_prompt, system_prompt=None, *args, **kwargs):
         return f"{main_prompt}\n\n{options_prompt}", system_prompt
 
-    def generate_response(self, video, main_prompt, system_prompt=None, generation_config=None, *args, **kwargs):
+    def to_model_device(self, video):
         video, image_sizes = video
+        return [x.to(self.model.device, non_blocking=True) for x in video], image_sizes
+
+    def generate_response(self, video, main_prompt, system_prompt=None, generation_config=None, *args, **kwargs):
+        video, image_sizes = self.to_model_device(video)
         conv = self.text_processor(main_prompt)
         prompt = conv.get_prompt()
 
@@ -50,6 +58,20 @@ class LongVUInferencePipeline(VidHalInferencePipeline):
 
         return response
 
+    def prefill_prompt(self, video, main_prompt, system_prompt=None, *args, **kwargs):
+        video, image_sizes = self.to_model_device(video)
+        input_ids = tokenizer_image_token(
+            self.text_processor(main_prompt).get_prompt(), 
+            self.text_processor.tokenizer, 
+            IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.model.device)
+        past_key_values, logits = prefill(
+            self.model, return_logits=True, inputs_embeds=self.model.prepare_inputs_labels_for_multimodal(
+                input_ids, None, None, None, None, video, image_sizes=image_sizes
+            )[4]
+        )
+
+        return logits, past_key_values
+
 class LongVUMCQAInferencePipeline(LongVUInferencePipeline, VidHalMCQAInferencePipeline):
     def __init__(self, dataset: VidHalDataset, model, vis_processor: LongVUVisualProcessor, text_processor: LongVUTextProcessor, num_captions=3, option_display_order: dict = None, generation_config=None, *args, **kwargs):
         super().__init__(dataset, model, vis_processor, text_processor, num_captions, option_display_order, generation_config, *args, **kwargs)
@@ -1,7 +1,9 @@
 import cv2
+from collections import OrderedDict
 from PIL import Image
 
 from dataset import VidHalDataset
+from frames import read_frames_cv2, get_video_metadata
 from pipelines.inference.base import (
     VidHalInferencePipeline,
     VidHalMCQAInferencePipeline,
@@ -10,30 +12,104 @@ from pipelines.inference.base import (
 )
 from models.MovieChat.conversation.conversation_video import Chat
 
+class MovieChatMemoryCache:
+    """
+    LRU cache of snapshots of the MovieChat video memory (long-term memory, short-term memory and the resulting video embedding),
+    keyed by (video, middle_video, cur_min, cur_sec), holding up to `max_size` snapshots.
+    """
+    def __init__(self, max_size=8) -> None:
+        self.max_size = max_size
+        self.snapshots = OrderedDict()
+
+    def get(self, key):
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None:
+            self.snapshots.move_to_end(key)
+
+        return snapshot
+
+    def put(self, key, snapshot):
+        if self.max_size < 1:
+            return
+        self.snapshots[key] = snapshot
+        self.snapshots.move_to_end(key)
+        while len(self.snapshots) > self.max_size:
+            self.snapshots.popitem(last=False)
+
 class MovieChatInferencePipeline(VidHalInferencePipeline):
+    memory_caches = {} # Model -> MovieChatMemoryCache, shared by the pipelines of all tasks
     def __init__(self, 
         dataset: VidHalDataset, model, vis_processor, text_processor : Chat, fragment_video_path=None,
-        num_captions=3, option_display_order: dict = None, generation_config=..., *args, **kwargs):
+        num_captions=3, option_display_order: dict = None, generation_config=..., *args,
+        memory_cache_size=8, # Video memory snapshots kept for later questions on the same video, 0 to disable
+        **kwargs):
         super().__init__(model, dataset, num_captions, option_display_order, generation_config, *args, **kwargs)
 
         self.vis_processor = text_processor.vis_processor
         self.text_processor = text_processor
         self.fragment_video_path = fragment_video_path
+        if model not in self.memory_caches:
+            self.memory_caches[model] = MovieChatMemoryCache(memory_cache_size if self.cache_visual_features else 0)
+        self.memory_cache = self.memory_caches[model]
 
     def format_prompt(self, main_prompt, options_prompt, system_prompt="", *args, **kwargs):
         return f"{main_prompt}\n\n{options_prompt}", system_prompt
     
     def get_first_frame(self, video_path):
         # Get first frame for long-video encoding
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, fps)
-        ret, frame = cap.read()
+        fps = get_video_metadata(video_path)["fps"]
+        frame = read_frames_cv2(video_path, [int(fps)])[int(fps)]
         image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         image = self.text_processor.image_vis_processor(image).unsqueeze(0).unsqueeze(2).half().to(self.model.device)
 
         return image
 
+    def encode_video(self, video_path, fragment_video_path, middle_video=False, cur_min=0, cur_sec=0):
+        cur_image = self.get_first_frame(video_path=video_path).to(self.model.device)
+        cur_image = self.model.encode_image(cur_image)
+        
+        video_emb = self.text_processor.upload_video_without_audio(
+            video_path=video_path, 
+            fragment_video_path=fragment_video_path,
+            cur_min=cur_min, cur_sec=cur_sec,
+            cur_image = cur_image, 
+            middle_video = middle_video
+        )
+
+        return video_emb
+
+    def snapshot_memory(self, video_emb):
+        # Buffers are only ever replaced or appended to by the model, hence copying the lists suffices
+        return {
+            "video_emb" : video_emb,
+            "long_memory_buffer" : list(self.model.long_memory_buffer),
+            "temp_short_memory" : list(self.model.temp_short_memory)
+        }
+
+    def restore_memory(self, snapshot):
+        self.model.long_memory_buffer = list(snapshot["long_memory_buffer"])
+        self.model.temp_short_memory = list(snapshot["temp_short_memory"])
+
+        return snapshot["video_emb"]
+
+    def get_video_embedding(self, video_path, fragment_video_path, middle_video=False, cur_min=0, cur_sec=0):
+        """
+        Returns the video embedding of the video, restoring the video memory from the snapshot of a previous question if available
+        """
+        # Breakpoints are only used in breakpoint mode, otherwise the whole video is encoded regardless
+        key = (video_path, middle_video, cur_min, cur_sec) if middle_video else (video_path, False, 0, 0)
+        snapshot = self.memory_cache.get(key)
+        if snapshot is not None:
+            return self.restore_memory(snapshot)
+
+        video_emb = self.encode_video(
+            video_path=video_path, fragment_video_path=fragment_video_path,
+            middle_video=middle_video, cur_min=cur_min, cur_sec=cur_sec
+        )
+        self.memory_cache.put(key, self.snapshot_memory(video_emb))
+
+        return video_emb
+
     def generate_response(
         self, video, image_path, main_prompt, 
         system_prompt=None, 
@@ -53,15 +129,9 @@ class MovieChatInferencePipeline(VidHalInferencePipeline):
         if fragment_video_path is None:
             fragment_video_path = self.fragment_video_path
 
-        cur_image = self.get_first_frame(video_path=image_path).to(self.model.device)
-        cur_image = self.model.encode_image(cur_image)
-        
-        video_emb = self.text_processor.upload_video_without_audio(
-            video_path=image_path, 
-            fragment_video_path=fragment_video_path,
-            cur_min=cur_min, cur_sec=cur_sec,
-            cur_image = cur_image, 
-            middle_video = middle_video
+        video_emb = self.get_video_embedding(
+            video_path=image_path, fragment_video_path=fragment_video_path,
+            middle_video=middle_video, cur_min=cur_min, cur_sec=cur_sec
         )
         if system_prompt is not None:
             main_prompt = f"{system_prompt}\n\n{main_prompt}"
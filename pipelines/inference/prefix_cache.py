@@ -0,0 +1,95 @@
+"""
+Utilities for prefilling a prompt prefix shared by several questions on the same video (e.g. system prompt, video tokens and instruction)
+once, and greedily decoding the response to each question from the cached `past_key_values` of the prefix.
+"""
+import copy
+import torch
+
+def get_cache_length(past_key_values):
+    if past_key_values is None:
+        return 0
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length()
+    return past_key_values[0][0].shape[-2] # Legacy tuple cache
+
+def split_prefix(input_ids, suffix_ids):
+    """
+    Returns the prefix of `input_ids` preceding `suffix_ids`, or None if the tokenized prompt does not end with the separately tokenized suffix
+    (e.g. tokens merged across the boundary), in which case the prefix cannot be shared.
+    """
+    input_ids, suffix_ids = input_ids.flatten(), suffix_ids.flatten()
+    if len(suffix_ids) == 0 or len(suffix_ids) >= len(input_ids):
+        return None
+    if not torch.equal(input_ids[-len(suffix_ids):].cpu(), suffix_ids.cpu()):
+        return None
+
+    return input_ids[:-len(suffix_ids)]
+
+def prefill(model, use_cache_position=False, return_logits=False, **inputs):
+    """
+    Runs the model over the prompt prefix only, returning the KV cache to be shared by all prompts continuing from the prefix,
+    along with the next-token logits at the end of the prefix if `return_logits` is set.
+    """
+    if use_cache_position:
+        length = (inputs["inputs_embeds"] if "inputs_embeds" in inputs else inputs["input_ids"]).shape[1]
+        device = (inputs["inputs_embeds"] if "inputs_embeds" in inputs else inputs["input_ids"]).device
+        inputs["cache_position"] = torch.arange(length, device=device)
+
+    outputs = model(**inputs, use_cache=True, return_dict=True)
+    if return_logits:
+        return outputs.past_key_values, outputs.logits[:, -1]
+
+    return outputs.past_key_values
+
+def forward_from_prefix(model, past_key_values, input_ids, use_cache_position=False):
+    """
+    Runs the model over `input_ids` continuing from `past_key_values`, returning the next-token logits and the updated cache.
+    NOTE: Cache objects are updated in-place
+    """
+    inputs = {"input_ids" : input_ids, "past_key_values" : past_key_values}
+    if use_cache_position:
+        cache_length = get_cache_length(past_key_values)
+        inputs["cache_position"] = torch.arange(cache_length, cache_length + input_ids.shape[1], device=input_ids.device)
+    outputs = model(**inputs, use_cache=True, return_dict=True)
+
+    return outputs.logits[:, -1], outputs.past_key_values
+
+@torch.no_grad()
+def generate_from_prefix(
+    model, past_key_values, input_ids,
+    max_new_tokens=128,
+    eos_token_id=None,
+    tokenizer=None, stop_str=None, # Optional stop string, checked against the decoded response
+    use_cache_position=False # Pass explicit cache positions to the model, required for models deriving positions from them (e.g. Qwen2.5-VL)
+):
+    """
+    Greedily decodes the response to the remainder of the prompt, `input_ids`, continuing from the prefilled `past_key_values`.
+    The prefix cache is left unchanged, so that it can be re-used for other prompts sharing the same prefix.
+
+    Returns:
+        output_ids (list) : Generated token IDs, excluding the end-of-sequence token
+    """
+    prefix_length = get_cache_length(past_key_values)
+    if eos_token_id is None:
+        eos_token_id = []
+    eos_token_id = set(eos_token_id) if isinstance(eos_token_id, (list, tuple, set)) else {eos_token_id}
+
+    output_ids, cache = [], past_key_values
+    if hasattr(past_key_values, "get_seq_length") and not hasattr(past_key_values, "crop"):
+        cache = copy.deepcopy(past_key_values)
+    try:
+        for _ in range(max_new_tokens):
+            logits, cache = forward_from_prefix(model, cache, input_ids, use_cache_position=use_cache_position)
+            next_token = logits.argmax(dim=-1)
+            if next_token.item() in eos_token_id:
+                break
+            output_ids.append(next_token.item())
+            if stop_str is not None and stop_str in tokenizer.decode(output_ids[-3:], skip_special_tokens=True):
+                break
+            input_ids = next_token.unsqueeze(-1)
+    finally:
+        # Cache objects are updated in-place, roll back to the prefix. Legacy tuple caches are never modified.
+        if hasattr(past_key_values, "crop"):
+            past_key_values.crop(prefix_length)
+
+    return output_ids
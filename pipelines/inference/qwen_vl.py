@@ -8,8 +8,10 @@ from pipelines.inference.base import (
     VidHalRelativeOrderingInferencePipeline
 )
 from qwen_vl_utils import process_vision_info
+from pipelines.inference.prefix_cache import prefill, generate_from_prefix
 
 class Qwen25VLInferencePipeline(VidHalInferencePipeline):
+    use_cache_position = True
     def __init__(self, 
         dataset: VidHalDataset, 
         model, vis_processor, text_processor,
@@ -38,6 +40,12 @@ class Qwen25VLInferencePipeline(VidHalInferencePipeline):
             ],
         }]
         text = self.text_processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        if self.use_prefix_cache and kwargs.get("options_prompt") and not generation_config.get("do_sample", False) and generation_config.get("num_beams", 1) == 1:
+            response = self.generate_response_with_prefix_cache(
+                messages, text, kwargs["options_prompt"], kwargs.get("image_path"), max_new_tokens=generation_config.get("max_new_tokens", 128)
+            )
+            if response is not None:
+                return response
 
         images, videos, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
         inputs = self.text_processor(
@@ -56,6 +64,95 @@ class Qwen25VLInferencePipeline(VidHalInferencePipeline):
 
         return response
 
+    def generate_response_with_prefix_cache(self, messages, text, options_prompt, video_path, max_new_tokens=128):
+        """
+        Greedy generation continuing from the cached prefix (system prompt, video and instruction) preceding the options in the prompt.
+        Returns None if the prompt cannot be split into a shared prefix.
+        """
+        tokenizer = self.text_processor.tokenizer
+        prefix_text, suffix_text = text[:text.rindex(options_prompt)], text[text.rindex(options_prompt):]
+        # Check that the prompt tokenizes identically when split (the video placeholder is only expanded with the video inputs)
+        input_ids, suffix_ids = tokenizer(text, add_special_tokens=False).input_ids, tokenizer(suffix_text, add_special_tokens=False).input_ids
+        if len(suffix_ids) == 0 or input_ids[-len(suffix_ids):] != suffix_ids:
+            return None
+
+        def prefill_prefix():
+            images, videos, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
+            inputs = self.text_processor(
+                text=[prefix_text], images=images, videos=videos, padding=True, return_tensors="pt",
+            ).to(self.model.device)
+            # Positions of the prompt continuation are derived from the cache positions and the multimodal rotary offsets of the prefix
+            return prefill(self.model, use_cache_position=True, **inputs)
+
+        past_key_values = self.get_visual_features(video_path, prefill_prefix, key=("prefix", prefix_text))
+        output_ids = generate_from_prefix(
+            self.model, past_key_values, torch.tensor([suffix_ids], device=self.model.device),
+            max_new_tokens=max_new_tokens, eos_token_id=self.model.generation_config.eos_token_id,
+            use_cache_position=True
+        )
+
+        return tokenizer.decode(output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
+    def prefill_prompt(self, video, main_prompt, system_prompt=None, *args, **kwargs):
+        del video; torch.cuda.empty_cache()
+        messages =  [{
+            "role": "system", "content": system_prompt if system_prompt else ""
+        }, {
+            "role": "user",
+            "content": [
+                {"type": "video", "video" : kwargs.get("image_path")},
+                {"type": "text", "text": main_prompt},
+            ],
+        }]
+        text = self.text_processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        images, videos, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
+        inputs = self.text_processor(
+            text=[text], images=images, videos=videos, padding=True, return_tensors="pt",
+        ).to(self.model.device)
+        past_key_values, logits = prefill(self.model, use_cache_position=True, return_logits=True, **inputs)
+
+        return logits, past_key_values
+
+    def generate_response_batch(self, videos, main_prompts, system_prompts=None, generation_config=None, *args, **kwargs):
+        if generation_config is None:
+            generation_config = {"do_sample" : False, "max_new_tokens" : 128}
+        if system_prompts is None:
+            system_prompts = [None] * len(main_prompts)
+
+        # Remove videos and load videos separately using qwen_vl_utils
+        del videos; torch.cuda.empty_cache()
+        messages = [[{
+            "role": "system", "content": system_prompt if system_prompt else ""
+        }, {
+            "role": "user",
+            "content": [
+                {"type": "video", "video" : image_path},
+                {"type": "text", "text": main_prompt},
+            ],
+        }] for main_prompt, system_prompt, image_path in zip(main_prompts, system_prompts, kwargs.get("image_paths"))]
+        texts = [self.text_processor.apply_chat_template(x, tokenize=False, add_generation_prompt=True) for x in messages]
+
+        images, videos, video_kwargs = process_vision_info(messages, return_video_kwargs=True)
+        # Left-pad prompts so that generation continues from the last prompt token of every sample, restoring the padding side
+        # of the shared tokenizer afterwards
+        padding_side = self.text_processor.tokenizer.padding_side
+        self.text_processor.tokenizer.padding_side = "left"
+        try:
+            inputs = self.text_processor(
+                text=texts,
+                images=images,
+                videos=videos,
+                padding=True,
+                return_tensors="pt",
+            ).to(self.model.device)
+        finally:
+            self.text_processor.tokenizer.padding_side = padding_side
+
+        output_ids = self.model.generate(**inputs, **generation_config)
+        output_ids_trimmed = [out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, output_ids)]
+
+        return self.text_processor.batch_decode(output_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
 class Qwen25VLMCQAInferencePipeline(Qwen25VLInferencePipeline, VidHalMCQAInferencePipeline):
     def __init__(self, dataset: VidHalDataset, model, vis_processor, text_processor, num_captions=3, option_display_order: dict = None, generation_config=None, *args, **kwargs):
         super().__init__(dataset, model, vis_processor, text_processor, num_captions, option_display_order, generation_config, *args, **kwargs)
@@ -50,10 +50,10 @@ class VideoChat2InferencePipeline(VidHalInferencePipeline):
             video = video.unsqueeze(0) # Add batch dimension
         video = video.to(self.model.device)
 
-        if system_q:
-            video_emb, _ = self.model.encode_visual_features(video, system_prompt + main_prompt)
-        else:
-            video_emb, _ = self.model.encode_visual_features(video, system_prompt)
+        instruction = system_prompt + main_prompt if system_q else system_prompt
+        video_emb, _ = self.get_visual_features(
+            kwargs.get("image_path"), lambda: self.model.encode_visual_features(video, instruction), key=instruction
+        )
         video_list = [video_emb]
 
         # Generate response
@@ -10,6 +10,7 @@ from pipelines.inference.base import (
 )
 from models.VideoLLaMA2.processors.visual_processor import VideoLLaMA2VisualProcessor
 from models.VideoLLaMA2.processors.text_processor import VideoLLaMA2TextProcessor
+from pipelines.inference.prefix_cache import split_prefix, prefill, generate_from_prefix
 
 class VideoLLaMA2InferencePipeline(VidHalInferencePipeline):
     def __init__(self, 
@@ -44,10 +45,20 @@ class VideoLLaMA2InferencePipeline(VidHalInferencePipeline):
         ], self.text_processor.tokenizer, input_ids)
 
         with torch.no_grad(), torch.inference_mode():
+            video_features = self.get_visual_features(
+                kwargs.get("image_path"), lambda: self.model.encode_images_or_videos([(video.half().cuda(), self.text_processor.modality)])
+            )
+            if self.use_prefix_cache and kwargs.get("options_prompt") and not do_sample and num_beams == 1 and num_return_sequences == 1:
+                response = self.generate_response_with_prefix_cache(
+                    video_features, input_ids, main_prompt, kwargs["options_prompt"], kwargs.get("image_path"), max_new_tokens=max_new_tokens
+                )
+                if response is not None:
+                    return response
+
             output_ids = self.model.generate(
                 input_ids,
                 attention_mask=attention_masks,
-                images=[(video.half().cuda(), self.text_processor.modality)],
+                images=video_features,
                 do_sample=do_sample,
                 temperature=temperature,
                 max_new_tokens=max_new_tokens,
@@ -64,6 +75,86 @@ class VideoLLaMA2InferencePipeline(VidHalInferencePipeline):
 
         return outputs
 
+    def generate_response_with_prefix_cache(self, video_features, input_ids, main_prompt, options_prompt, video_path, max_new_tokens=128):
+        """
+        Greedy generation continuing from the cached prefix (system prompt, video and instruction) preceding the options in the prompt.
+        Returns None if the prompt cannot be split into a shared prefix.
+        """
+        tokenizer = self.text_processor.tokenizer
+        suffix_ids = tokenizer(main_prompt[main_prompt.rindex(options_prompt):], add_special_tokens=False, return_tensors="pt").input_ids
+        prefix_ids = split_prefix(input_ids, suffix_ids)
+        if prefix_ids is None:
+            return None
+
+        past_key_values = self.get_visual_features(video_path, lambda: prefill(
+            self.model, inputs_embeds=self.model.prepare_inputs_labels_for_multimodal(
+                input_ids=prefix_ids.unsqueeze(0), attention_mask=None, past_key_values=None, labels=None, images=video_features
+            )[3]
+        ), key=("prefix", tuple(prefix_ids.tolist())))
+
+        output_ids = generate_from_prefix(
+            self.model, past_key_values, suffix_ids.to(input_ids.device),
+            max_new_tokens=max_new_tokens, eos_token_id=tokenizer.eos_token_id
+        )
+
+        return tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+
+    def prefill_prompt(self, video, main_prompt, system_prompt=None, *args, **kwargs):
+        input_ids = tokenizer_multimodal_token(
+            main_prompt, self.text_processor.tokenizer, self.text_processor.visual_token, return_tensors="pt"
+        ).unsqueeze(0).long().cuda()
+        video_features = self.get_visual_features(
+            kwargs.get("image_path"), lambda: self.model.encode_images_or_videos([(video.half().cuda(), self.text_processor.modality)])
+        )
+        past_key_values, logits = prefill(
+            self.model, return_logits=True, inputs_embeds=self.model.prepare_inputs_labels_for_multimodal(
+                input_ids=input_ids, attention_mask=None, past_key_values=None, labels=None, images=video_features
+            )[3]
+        )
+
+        return logits, past_key_values
+
+    def generate_response_batch(
+        self, videos, main_prompts, system_prompts=None, 
+        do_sample=False,
+        temperature=0.2,
+        top_p=0.9,
+        max_new_tokens=128,
+        num_beams=1,
+        *args, **kwargs
+    ):
+        tokenizer = self.text_processor.tokenizer
+        # Left-pad prompts so that generation continues from the last prompt token of every sample
+        input_ids = [
+            tokenizer_multimodal_token(prompt, tokenizer, self.text_processor.visual_token, return_tensors="pt").long() for prompt in main_prompts
+        ]
+        max_length = max(len(x) for x in input_ids)
+        attention_masks = torch.stack([
+            torch.cat([torch.zeros(max_length - len(x), dtype=torch.long), torch.ones(len(x), dtype=torch.long)]) for x in input_ids
+        ]).cuda()
+        input_ids = torch.stack([
+            torch.cat([torch.full((max_length - len(x),), tokenizer.pad_token_id, dtype=torch.long), x]) for x in input_ids
+        ]).cuda()
+
+        stopping_criteria = KeywordsStoppingCriteria([tokenizer.eos_token], tokenizer, input_ids)
+
+        with torch.no_grad(), torch.inference_mode():
+            output_ids = self.model.generate(
+                input_ids,
+                attention_mask=attention_masks,
+                images=[(video.half().cuda(), self.text_processor.modality) for video in videos],
+                do_sample=do_sample,
+                temperature=temperature,
+                max_new_tokens=max_new_tokens,
+                top_p=top_p,
+                use_cache=True,
+                stopping_criteria=[stopping_criteria],
+                num_beams=num_beams,
+                pad_token_id=tokenizer.eos_token_id,
+            )
+
+        return [x.strip() for x in tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
+
 class VideoLLaMA2MCQAInferencePipeline(VideoLLaMA2InferencePipeline, VidHalMCQAInferencePipeline):
     def __init__(self, dataset, model, vis_processor, text_processor, num_captions=3, option_display_order = None, generation_config=..., *args, **kwargs):
         super().__init__(dataset, model, vis_processor, text_processor, num_captions, option_display_order, generation_config, *args, **kwargs)
@@ -0,0 +1,113 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+gpt4 = pytest.importorskip("pipelines.inference.gpt4")
+from pipelines.inference.base import VidHalInferencePipeline
+
+class MockChatServer(ThreadingHTTPServer):
+    """
+    Local OpenAI-compatible chat completions server. Prompts are answered after a delay decreasing with their index, such that
+    requests complete out of order, and the first attempt of prompts in `failures` is answered with the given status code.
+    """
+    daemon_threads = True
+    def __init__(self, failures=None, delay=0.05):
+        super().__init__(("127.0.0.1", 0), MockChatHandler)
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.attempts = {}
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status_code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        prompt = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["messages"][-1]["content"]
+        with server.lock:
+            server.attempts.setdefault(prompt, []).append(time.monotonic())
+            num_attempts = len(server.attempts[prompt])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay * (1 + 1 / (1 + int(prompt.split("-")[-1]))))
+            if prompt in server.failures and num_attempts == 1:
+                return self.send_json(server.failures[prompt], {"error" : {"message" : "mock error", "type" : "mock", "code" : None}})
+            self.send_json(200, {
+                "id" : "mock", "object" : "chat.completion", "created" : 0, "model" : "mock",
+                "choices" : [{"index" : 0, "finish_reason" : "stop", "message" : {"role" : "assistant", "content" : f"answer to {prompt}"}}]
+            })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+@pytest.fixture
+def server(request):
+    server = MockChatServer(**getattr(request, "param", {}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get_pipeline(server, max_concurrency):
+    pipeline = gpt4.GPT4oInferencePipeline(
+        model="mock", api_key="mock", dataset=None, option_display_order={},
+        api_base_url=server.base_url, max_concurrency=max_concurrency, max_retries=3
+    )
+    pipeline.engine.get_backoff_delay = lambda attempt: 0.1 * 2 ** attempt
+    return pipeline
+
+def request_all(pipeline, prompts):
+    return pipeline.generate_response_batch([None] * len(prompts), prompts, system_prompts=["system"] * len(prompts))
+
+def test_responses_keep_request_order_within_concurrency_limit(server):
+    prompts = [f"prompt-{i}" for i in range(12)]
+    responses = request_all(get_pipeline(server, max_concurrency=3), prompts)
+
+    assert responses == [f"answer to {x}" for x in prompts]
+    assert server.max_in_flight == 3
+
+@pytest.mark.parametrize("server", [{"failures" : {"prompt-1" : 429, "prompt-4" : 503, "prompt-6" : 400}}], indirect=True)
+def test_transient_errors_are_retried_with_backoff(server):
+    prompts = [f"prompt-{i}" for i in range(8)]
+    responses = request_all(get_pipeline(server, max_concurrency=4), prompts)
+
+    assert responses == [f"answer to {x}" if x != "prompt-6" else "" for x in prompts]
+    for prompt in ["prompt-1", "prompt-4"]:
+        first, second = server.attempts[prompt]
+        assert second - first >= 0.1 # Backoff delay of the first retry
+    # Bad requests are not retried
+    assert len(server.attempts["prompt-6"]) == 1
+    assert all(len(server.attempts[x]) == 1 for x in prompts if x not in ["prompt-1", "prompt-4"])
+
+def test_visual_features_are_encoded_once_across_threads():
+    pipeline = VidHalInferencePipeline.__new__(VidHalInferencePipeline)
+    pipeline.cache_visual_features, pipeline.visual_features = True, {}
+    num_encodings = []
+    def encode_fn():
+        num_encodings.append(1)
+        time.sleep(0.05)
+        return "frames"
+
+    threads = [threading.Thread(target=pipeline.get_visual_features, args=("video.mp4", encode_fn)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(num_encodings) == 1 and pipeline.visual_features == {("video.mp4", None) : "frames"}
@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from cache import VideoFrameCache
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 48))
+    for i in range(30):
+        writer.write(np.full((48, 64, 3), 8 * i, dtype=np.uint8))
+    writer.release()
+    return path
+
+def test_cache_hit_matches_miss(tmp_path, video_path):
+    cache = VideoFrameCache(str(tmp_path / "cache"))
+    miss = cache.read_video(video_path, num_frames=8, sample="middle")
+    hit = cache.read_video(video_path, num_frames=8, sample="middle")
+
+    for x, y in zip(miss, hit):
+        assert type(x) is type(y)
+    assert miss[1].dtype == hit[1].dtype == np.int64 and np.array_equal(miss[1], hit[1])
+    assert torch.equal(miss[0], hit[0]) and miss[2] == hit[2]
+
+def test_evicted_entry_is_still_returned(tmp_path, video_path, monkeypatch):
+    cache = VideoFrameCache(str(tmp_path / "cache"))
+    miss = cache.read_video(video_path, num_frames=8, sample="middle")
+    # Another process evicts the entry right after it is loaded
+    def utime(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr("cache.os.utime", utime)
+
+    hit = cache.read_video(video_path, num_frames=8, sample="middle")
+    assert torch.equal(miss[0], hit[0])
@@ -0,0 +1,80 @@
+import types
+import pytest
+
+gemini = pytest.importorskip("pipelines.inference.gemini")
+
+class FakeFileAPI:
+    """
+    In-memory stand-in for the Gemini File API, whose uploads are processed into `upload_state`
+    """
+    def __init__(self, files=None, upload_state="ACTIVE"):
+        self.files = dict(files or {})
+        self.upload_state = upload_state
+        self.uploads, self.deletions = [], []
+
+    def make_file(self, name, state):
+        return types.SimpleNamespace(
+            name=name, uri=f"https://files/{name}", mime_type="video/mp4", expiration_time=None, state=types.SimpleNamespace(name=state)
+        )
+
+    def get_file(self, name):
+        if name not in self.files:
+            raise KeyError(name)
+        return self.make_file(name, self.files[name])
+
+    def upload_file(self, path, name):
+        assert name not in self.files, "File names must be freed before uploading again"
+        self.uploads.append(name)
+        self.files[name] = self.upload_state
+        return self.make_file(name, self.upload_state)
+
+    def delete_file(self, name):
+        self.deletions.append(name)
+        del self.files[name]
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = tmp_path / "video_1.mp4"
+    path.write_bytes(b"video")
+    return str(path)
+
+def patch_file_api(monkeypatch, file_api):
+    for name in ["get_file", "upload_file", "delete_file"]:
+        monkeypatch.setattr(gemini.genai, name, getattr(file_api, name))
+
+def test_failed_remote_file_is_uploaded_again(monkeypatch, video_path):
+    registry = gemini.GeminiFileRegistry()
+    key = registry.get_key(video_path)
+    file_api = FakeFileAPI(files={key : "FAILED"})
+    patch_file_api(monkeypatch, file_api)
+
+    entry = registry.get(video_path)
+    assert file_api.deletions == [key] and file_api.uploads == [key]
+    assert entry["name"] == key and file_api.files[key] == "ACTIVE"
+
+def test_failed_processing_is_retried(monkeypatch, video_path):
+    file_api = FakeFileAPI(upload_state="FAILED")
+    patch_file_api(monkeypatch, file_api)
+    registry = gemini.GeminiFileRegistry()
+
+    with pytest.raises(gemini.GeminiUploadError) as error:
+        registry.upload(video_path)
+    assert gemini.GeminiInferencePipeline.is_retryable(None, error.value)
+    assert not gemini.GeminiInferencePipeline.is_retryable(None, ValueError("invalid argument"))
+
+    # The next attempt frees the name of the failed file and uploads again
+    file_api.upload_state = "ACTIVE"
+    assert registry.upload(video_path)["name"] == file_api.uploads[-1]
+    assert len(file_api.uploads) == 2 and len(file_api.deletions) == 1
+
+def test_shared_registry_hashes_and_uploads_once(monkeypatch, video_path):
+    file_api = FakeFileAPI()
+    patch_file_api(monkeypatch, file_api)
+    registry = gemini.GeminiFileRegistry()
+    num_hashes = []
+    sha1 = gemini.hashlib.sha1
+    monkeypatch.setattr(gemini.hashlib, "sha1", lambda *args: num_hashes.append(1) or sha1(*args))
+
+    for _ in range(3): # e.g. the pipelines of three tasks
+        registry.upload_all([video_path], num_workers=1)
+    assert len(file_api.uploads) == 1 and len(num_hashes) == 1
@@ -0,0 +1,46 @@
+import pytest
+import torch
+
+try:
+    from pipelines.inference.longvu import LongVUInferencePipeline
+    from models.LongVU.processors.text_processor import LongVUTextProcessor
+except Exception as e: # LongVU requires its dependencies (and model configs) to be importable
+    pytest.skip(f"LongVU pipeline unavailable: {e}", allow_module_level=True)
+
+class CharTokenizer:
+    bos_token_id = None
+
+    def __call__(self, text):
+        return type("Encoding", (), {"input_ids" : [ord(x) for x in text]})()
+
+    def batch_decode(self, output_ids, skip_special_tokens=True):
+        return [" ".join(str(int(x)) for x in ids) for ids in output_ids]
+
+class PromptLengthModel:
+    """
+    Stand-in for LongVU whose response depends on the length of the whole prompt, as its frame selection does
+    """
+    device = torch.device("cpu")
+
+    def generate(self, input_ids, images=None, image_sizes=None, **kwargs):
+        return torch.tensor([[input_ids.shape[1], len(images)]])
+
+    def prepare_inputs_labels_for_multimodal(self, input_ids, *args, **kwargs):
+        raise AssertionError("LongVU must not prefill a prompt prefix")
+
+def get_pipeline(use_prefix_cache):
+    return LongVUInferencePipeline(
+        dataset=None, model=PromptLengthModel(), vis_processor=None, text_processor=LongVUTextProcessor(CharTokenizer()),
+        option_display_order={}, use_prefix_cache=use_prefix_cache
+    )
+
+def test_prefix_cache_matches_uncached_responses():
+    video = ([torch.zeros(1, 4, 3, 8, 8)], [(8, 8)])
+    main_prompt, options_prompts = "Which caption best describes the video?", ["A. a dog runs\nB. a cat", "A. a cat\nB. a dog runs fast"]
+
+    cached, uncached = get_pipeline(True), get_pipeline(False)
+    assert not cached.use_prefix_cache
+    for options_prompt in options_prompts:
+        prompt, _ = cached.format_prompt(main_prompt, options_prompt)
+        assert cached.generate_response(video, prompt, options_prompt=options_prompt, image_path="video.mp4") == \
+            uncached.generate_response(video, prompt, options_prompt=options_prompt, image_path="video.mp4")
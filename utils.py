@@ -13,13 +13,23 @@ def parse_arguments():
 
     # Dataset parameters
     parser.add_argument("--annotations_path", type=str, required=True)
-    parser.add_argument("--videos_path", type=str, required=True)
+    parser.add_argument("--videos_path", type=str, default=None) # Required for inference only
     parser.add_argument("--options_path", type=str, default=None)
     parser.add_argument("--num_frames", type=int, default=4)
+    parser.add_argument("--frame_cache_dir", type=str, default=None) # Directory for caching decoded frames across runs
+    parser.add_argument("--frame_cache_size", type=float, default=32) # Maximum frame cache size in GB
+    parser.add_argument("--metadata_index_path", type=str, default=None) # Index of video metadata, defaults to video_metadata.json beside the annotations
 
     # Inference parameters
-    parser.add_argument("--task", type=str, required=True)
+    parser.add_argument("--task", type=str, required=True) # Comma-separated tasks (e.g. mcqa,naive_ordering,relative_ordering) are run in a single pass
     parser.add_argument("--num_captions", type=int, default=3)
+    parser.add_argument("--num_workers", type=int, default=0) # Background workers for video loading, 0 loads in the main process
+    parser.add_argument("--prefetch_factor", type=int, default=2)
+    parser.add_argument("--pin_memory", action="store_true")
+    parser.add_argument("--batch_size", type=int, default=1) # Videos per generation call for MCQA and naive caption ordering
+    parser.add_argument("--disable_visual_feature_cache", action="store_true") # Re-encode the video for every prompt
+    parser.add_argument("--prefix_cache", action="store_true") # Prefill the prompt prefix shared by questions on the same video once
+    parser.add_argument("--scoring", action="store_true") # Select MCQA and naive ordering options from option letter logits instead of parsing generated responses
 
     # Model parameters
     parser.add_argument("--model", type=str, default="random")
@@ -34,12 +44,23 @@ def parse_arguments():
     parser.add_argument("--config_path", type=str, default=None)
     # MovieChat parameters
     parser.add_argument("--fragment_video_path", type=str, default=None)
+    parser.add_argument("--memory_cache_size", type=int, default=8) # Video memory snapshots kept for later questions on the same video, 0 to disable
     # Proprietary model parameters
     parser.add_argument("--api_key", type=str, default=None)
+    parser.add_argument("--api_base_url", type=str, default=None) # OpenAI-compatible server for GPT models (e.g. local mock servers)
+    parser.add_argument("--max_concurrency", type=int, default=8) # Maximum number of API requests in flight, for batches of --batch_size examples
+    parser.add_argument("--requests_per_minute", type=float, default=None) # API rate limit, None for no limit
+    parser.add_argument("--max_retries", type=int, default=5) # Retries of failed API requests with exponential backoff
+    parser.add_argument("--frame_store_dir", type=str, default=None) # Directory of pre-encoded frames sent to API models, built once for all videos
+    parser.add_argument("--frame_store_workers", type=int, default=8)
+    parser.add_argument("--upload_registry_path", type=str, default=None) # JSON registry of videos uploaded to Gemini, re-used across runs
+    parser.add_argument("--jpeg_quality", type=int, default=95) # JPEG quality of frames sent to API models
+    parser.add_argument("--max_frame_side", type=int, default=None) # Downscale frames sent to API models to this maximum side length
 
     # Evaluation parameters
     parser.add_argument("--predictions_path", type=str, default=None)
     parser.add_argument("--save_path", type=str, default=None)
+    parser.add_argument("--fsync_interval", type=int, default=1) # Responses between each fsync of the inference checkpoint, 0 leaves flushing to the OS
 
     # TODO: Add more parameters if needed
     args = parser.parse_args()
@@ -76,22 +97,29 @@ def generate_display_order(dataset):
 Adapted from VideoChat2: https://github.com/OpenGVLab/Ask-Anything/blob/main/video_chat2/dataset/video_utils.py
 """
 def get_frame_indices(num_frames, vlen, sample='rand', fix_start=None, fps=1, max_num_frames=-1, clip=None):
+    """
+    Plans the indices of the frames sampled from a video of `vlen` frames, shared by all video loaders. Sampling modes:
+    1. rand / fix_start: A random frame (or the frame at `fix_start`) of each of `num_frames` equal intervals.
+    2. middle: The middle frame of each of `num_frames` equal segments, of the clip (`clip`, in seconds) if provided.
+    3. fpsX: Frames sequentially sampled at X fps, up to `max_num_frames` frames.
+    4. uniform: `num_frames` frames strided from the first frame (MovieChat).
+    5. linspace: `num_frames` evenly spaced frames including the first and last frames (API models).
+
+    Returns:
+        frame_indices (np.ndarray) : Contiguous int64 array of frame indices
+    """
     if sample in ["rand", "middle"]: # Uniform sampling
         acc_samples = min(num_frames, vlen)
         # Split the video into `acc_samples` intervals, and sample from each interval.
         intervals = np.linspace(start=0, stop=vlen, num=acc_samples + 1).astype(int)
-        ranges = []
-        for idx, interv in enumerate(intervals[:-1]):
-            ranges.append((interv, intervals[idx + 1] - 1))
+        starts, ends = intervals[:-1], intervals[1:] - 1
         if sample == 'rand':
-            try:
-                frame_indices = [random.choice(range(x[0], x[1])) for x in ranges]
-            except:
-                frame_indices = np.random.permutation(vlen)[:acc_samples]
-                frame_indices.sort()
-                frame_indices = list(frame_indices)
+            if np.all(ends > starts):
+                frame_indices = starts + (np.random.random(acc_samples) * (ends - starts)).astype(int)
+            else: # Intervals too short to sample from
+                frame_indices = np.sort(np.random.permutation(vlen)[:acc_samples])
         elif fix_start is not None:
-            frame_indices = [x[0] + fix_start for x in ranges]
+            frame_indices = starts + fix_start
         elif sample == 'middle':
             if clip:
                 start_idx, end_idx = round(clip[0] * fps), min(round(clip[1] * fps), max_num_frames)
@@ -101,29 +129,29 @@ def get_frame_indices(num_frames, vlen, sample='rand', fix_start=None, fps=1, ma
                 start_idx, end_idx  = 0, max_num_frames
             
             seg_size = float(end_idx - start_idx) / num_frames
-            frame_indices = np.array([
-                int(start_idx + (seg_size / 2) + np.round(seg_size * idx)) for idx in range(num_frames)
-            ])
+            frame_indices = (start_idx + (seg_size / 2) + np.round(seg_size * np.arange(num_frames))).astype(int)
         else:
             raise NotImplementedError
 
         if len(frame_indices) < num_frames:  # padded with last frame
-            padded_frame_indices = [frame_indices[-1]] * num_frames
-            padded_frame_indices[:len(frame_indices)] = frame_indices
-            frame_indices = padded_frame_indices
+            frame_indices = np.concatenate([frame_indices, np.full(num_frames - len(frame_indices), frame_indices[-1])])
     elif "fps" in sample:  # Sequentially sample frames at 0.5 fps
         output_fps = float(sample[3:])
         duration = float(vlen) / fps
         delta = 1 / output_fps  # Gap between frames, this is also the clip length each frame represents
         frame_seconds = np.arange(0 + delta / 2, duration + delta / 2, delta)
         frame_indices = np.around(frame_seconds * fps).astype(int)
-        frame_indices = [e for e in frame_indices if e < vlen]
+        frame_indices = frame_indices[frame_indices < vlen]
         if max_num_frames > 0 and len(frame_indices) > max_num_frames:
             frame_indices = frame_indices[:max_num_frames]
-            # frame_indices = np.linspace(0 + delta / 2, duration + delta / 2, endpoint=False, num=max_num_frames)
+    elif sample == "uniform":
+        frame_indices = np.arange(0, vlen, vlen / min(num_frames, vlen)).astype(int) if vlen > 0 else np.zeros(0)
+    elif sample == "linspace":
+        frame_indices = np.linspace(0, vlen - 1, num=min(num_frames, vlen), dtype=int) if vlen > 0 else np.zeros(0)
     else:
         raise ValueError
-    return frame_indices
+
+    return np.ascontiguousarray(frame_indices, dtype=np.int64)
     
 def read_video(
     video_path, num_frames=None, sample='rand', fix_start=None, client=None, clip=None